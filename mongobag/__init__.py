@@ -4,8 +4,16 @@
 # This module is part of MongoBag and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
+from .cache import QueryCache
 from .declarative import Document
 from .declarative import DocumentMeta
+from .declarative import Instrumentation
+from .declarative import Metrics
+from .declarative import deferred_validation
+from .declarative import set_instrumentation
+from .indexes import Index
+from .query import Query
+from .session import Session
 from .schemas import Boolean
 from .schemas import Date
 from .schemas import DateTime
@@ -15,16 +23,23 @@ from .schemas import Field
 from .schemas import Float
 from .schemas import Integer
 from .schemas import ObjectId
+from .schemas import Reference
+from .schemas import ReferenceList
 from .schemas import String
 from .schemas import Time
+from .exc import BulkWriteError
 from .exc import DocumentAttributeError
 from .exc import DocumentTypeError
+from .exc import FieldNotLoaded
 from .exc import MultipleResultsFound
 from .exc import NoResultFound
+from .exc import UnindexedQueryWarning
+from .exc import ValidationError
 
 
 __all__ = [
     'Boolean',
+    'BulkWriteError',
     'Date',
     'DateTime',
     'Document',
@@ -34,11 +49,24 @@ __all__ = [
     'EmbeddedDocument',
     'EmbeddedList',
     'Field',
+    'FieldNotLoaded',
     'Float',
+    'Index',
+    'Instrumentation',
     'Integer',
+    'Metrics',
     'MultipleResultsFound',
     'NoResultFound',
     'ObjectId',
+    'Query',
+    'QueryCache',
+    'Reference',
+    'ReferenceList',
+    'Session',
     'String',
-    'Time'
+    'Time',
+    'UnindexedQueryWarning',
+    'ValidationError',
+    'deferred_validation',
+    'set_instrumentation'
 ]
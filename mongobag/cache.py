@@ -0,0 +1,137 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import collections
+import copy
+import itertools
+import logging
+import time
+import weakref
+
+__all__ = ['QueryCache']
+
+log = logging.getLogger(__file__)
+
+
+caches = weakref.WeakSet()  # every QueryCache, invalidated by the writes.
+
+
+class QueryCache(object):
+    """ Cache of the raw documents returned by find and find_one when they
+        receive cache=: results are kept for ttl seconds, at most maxsize
+        queries are kept and the least recently used ones are dropped.
+        find results of more than max_documents documents are not cached.
+
+        The writes made through Document methods invalidate the queries of
+        their collection in every QueryCache.
+    """
+
+    def __init__(self, maxsize=1000, ttl=60, timer=time.monotonic,
+                 max_documents=1000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.max_documents = max_documents
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        caches.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ Return a copy of the documents cached for key, None if they are
+            not cached or expired.
+        """
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self.timer():
+            if entry is not None:
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, docs):
+        """ Cache docs, a list of raw documents, for key.
+        """
+
+        self._entries[key] = (self.timer() + self.ttl, copy.deepcopy(docs))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set_cursor(self, key, cursor):
+        """ Cache the documents of cursor for key when they are at most
+            max_documents, return an iterable of all of them: the others
+            are read from cursor as they are needed.
+        """
+
+        docs = list(itertools.islice(cursor, self.max_documents + 1))
+        if len(docs) > self.max_documents:
+            return itertools.chain(docs, cursor)
+
+        self.set(key, docs)
+        return docs
+
+    def invalidate(self, collection=None):
+        """ Drop the queries of collection (its full name), all of them if
+            collection is None.
+        """
+
+        if collection is None:
+            self._entries.clear()
+            return
+
+        for key in [key for key in self._entries if key[0] == collection]:
+            del self._entries[key]
+
+
+def get_query_key(collection, method, criterion, options):
+    """ Return the cache key of a query, None if it cannot be cached.
+    """
+
+    try:
+        key = (collection.full_name, method,
+               freeze(criterion), freeze(options))
+        hash(key)
+
+    except TypeError:
+        return None
+
+    return key
+
+
+def freeze(value):
+    """ Return a hashable equivalent of value: dicts (mongoq queries too)
+        become tuples of items in their order, which matters to MongoDB
+        (e.g. in subdocument equality), lists become tuples.
+    """
+
+    if isinstance(value, dict):
+        return (dict, tuple((key, freeze(item))
+                            for key, item in value.items()))
+
+    if isinstance(value, (list, tuple)):
+        return (list, tuple(freeze(item) for item in value))
+
+    if isinstance(value, (set, frozenset)):
+        return (set, frozenset(freeze(item) for item in value))
+
+    return value
+
+
+def invalidate_queries(collection):
+    """ Drop the queries of collection from every QueryCache.
+    """
+
+    for cache in list(caches):
+        cache.invalidate(collection.full_name)
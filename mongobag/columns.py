@@ -0,0 +1,93 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+from .schemas import (Boolean,
+                      Date,
+                      DateTime,
+                      Float,
+                      Integer)
+import datetime
+import logging
+
+try:
+    import numpy
+
+except ImportError:  # numpy is needed by Document.find_columns only.
+    numpy = None
+
+__all__ = []
+
+log = logging.getLogger(__file__)
+
+
+# NumPy dtype of the fields, by field class: the others give object arrays.
+DTYPES = [
+    (Boolean, 'bool'),
+    (Integer, 'int64'),
+    (Float, 'float64'),
+    (DateTime, 'datetime64[ms]'),
+    (Date, 'datetime64[D]'),
+]
+
+
+def require_numpy():
+
+    if numpy is None:
+        raise ImportError('Document.find_columns requires numpy.')
+
+
+def get_dtype(field):
+
+    for class_, dtype in DTYPES:
+        if isinstance(field, class_):
+            return dtype
+
+    return 'object'
+
+
+def to_array(field, values):
+    """ Return a NumPy array of values, typed after field.
+
+        Missing values are NaN in float arrays and NaT in datetime ones,
+        boolean and integer arrays with missing values are masked.
+    """
+
+    dtype = get_dtype(field)
+    if dtype == 'object':
+        return numpy.array(values, dtype=object)
+
+    if dtype == 'datetime64[ms]':
+        values = [to_naive_utc(value) for value in values]
+
+    mask = [value is None for value in values]
+    if not any(mask):
+        return numpy.array(values, dtype=dtype)
+
+    if dtype == 'float64':
+        return numpy.array([numpy.nan if missing else value
+                            for value, missing in zip(values, mask)],
+                           dtype=dtype)
+
+    if dtype.startswith('datetime64'):
+        return numpy.array(['NaT' if missing else value
+                            for value, missing in zip(values, mask)],
+                           dtype=dtype)
+
+    fill = numpy.zeros((), dtype=dtype).item()
+    data = numpy.array([fill if missing else value
+                        for value, missing in zip(values, mask)],
+                       dtype=dtype)
+    return numpy.ma.MaskedArray(data, mask=mask)
+
+
+def to_naive_utc(value):
+    """ NumPy datetimes have no timezone: convert aware ones to UTC.
+    """
+
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return value
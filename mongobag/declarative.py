@@ -4,25 +4,701 @@
 # This module is part of MongoBag and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
-from .exc import (DocumentAttributeError,
+from .cache import (get_query_key,
+                    invalidate_queries)
+from .columns import (require_numpy,
+                      to_array)
+from .exc import (BulkWriteError,
+                  DocumentAttributeError,
+                  FieldNotLoaded,
                   NoResultFound,
-                  DocumentTypeError)
+                  DocumentTypeError,
+                  ValidationError)
+from .indexes import (clear_explained,
+                      explain,
+                      get_index)
 from .schemas import (Field,
                       EmbeddedDocument,
                       EmbeddedList,
-                      ObjectId)
+                      ObjectId,
+                      Reference,
+                      ReferenceList,
+                      unassigned)
+from .paging import (decode_token,
+                     encode_token,
+                     get_range,
+                     get_sort_keys,
+                     get_values)
+from .query import Query
+from .session import (evict_document,
+                      get_criterion_id)
+from .types import (dumps_json,
+                    loads_json)
+import bson
+import collections
 import colander
+import contextlib
+import contextvars
+import itertools
 import logging
 import mongoq
+import pymongo
+import time
 import warnings
+import weakref
 
 
-__all__ = ['DocumentMeta', 'Document']
+__all__ = ['DocumentMeta', 'Document', 'Instrumentation', 'Metrics',
+           'deferred_validation', 'set_instrumentation']
 
 
 log = logging.getLogger(__file__)
 
 
+unloaded = object()  # value of the fields excluded by a projection.
+clean = frozenset()  # _dirty of the tracked documents without changes.
+# Instance state of the documents, set to None first by __init__ and load:
+# in slots of compact classes, at the start of the instance attributes of
+# the others (adding attributes later may turn their storage into a dict).
+STATE = ('_dirty', '_serialized')
+# Instance state rarely set, in the _extra dict of compact classes.
+EXTRA_STATE = ('_db', '_refs', '_pending')
+instrumentation = None  # Instrumentation receiving the events, if any.
+deferring = contextvars.ContextVar('deferring', default=False)
+# True once a class defers validation or deferred_validation is used: until
+# then no document can have pending values, nothing is checked.
+deferred = False
+get_attribute = object.__getattribute__
+
+
+class Attribute(object):
+    """ Descriptor of a document field: it returns the MongoQ query of the
+        field when it is accessed on the class, the value on instances.
+
+        Values are stored in slot, the member descriptor of the slot of the
+        field in compact classes. When slot is None they are attributes of
+        the instance named key, the name of the field followed by a dot:
+        the descriptor hides the name itself. validate is the Document
+        method used to check values assigned to the field.
+    """
+
+    __slots__ = ('name', 'key', 'slot', 'query', 'validate')
+
+    deferrable = True  # values can be validated later, see __deferred__.
+
+    def __init__(self, name, slot, validate=None):
+        self.name = name
+        self.key = name + '.'
+        self.slot = slot
+        self.query = getattr(mongoq.Q, name)
+        self.validate = validate
+
+    def __get__(self, obj, type_=None):
+
+        if obj is None:
+            return self.query
+
+        try:
+            if self.slot is None:
+                value = get_attribute(obj, self.key)
+
+            else:
+                value = self.slot.__get__(obj)
+
+        except AttributeError:
+            value = colander.null
+
+        if value is unassigned or value is unloaded:
+            raise self.missing(obj, value)
+
+        return value
+
+    def __set__(self, obj, value):
+
+        if self.validate is None:
+            pass
+
+        elif deferred and self.deferrable and \
+                (obj.__deferred__ or deferring.get()):
+            # Validated by obj.validate(), at the latest before a write.
+            object.__setattr__(obj, '_pending', True)
+
+        else:
+            value = self.validate(obj, self.name, value)
+
+        self.set_raw(obj, value)
+
+        dirty = obj._dirty
+        if dirty is clean:
+            # The set is created on the first change.
+            object.__setattr__(obj, '_dirty', {self.name})
+
+        elif dirty is not None:
+            dirty.add(self.name)
+
+    def missing(self, obj, value):
+        """ Return the exception raised reading a field without value.
+        """
+
+        if value is unloaded:
+            msg = '{}.{} is not loaded: use reload() to load it.'
+            return FieldNotLoaded(msg.format(obj.__class__.__name__, self.name))
+
+        return AttributeError(self.name)
+
+    def get_raw(self, obj):
+        """ Return the stored value, colander.null if it is not set.
+        """
+
+        try:
+            if self.slot is None:
+                return get_attribute(obj, self.key)
+
+            return self.slot.__get__(obj)
+
+        except AttributeError:
+            # Not set yet, or field added to the class after obj creation.
+            return colander.null
+
+    def set_raw(self, obj, value):
+        """ Store value without validation.
+        """
+
+        if self.slot is None:
+            object.__setattr__(obj, self.key, value)
+
+        else:
+            self.slot.__set__(obj, value)
+
+        if obj._serialized is not None:
+            object.__setattr__(obj, '_serialized', None)
+
+
+class ExtraSlot(object):
+    """ Storage of the fields added to a compact class after its creation:
+        its instances have no slot for them, values go in their _extra dict.
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, type_=None):
+
+        if obj is None:
+            return self
+
+        extra = obj._extra
+        if extra is None or self.name not in extra:
+            raise AttributeError(self.name)
+
+        return extra[self.name]
+
+    def __set__(self, obj, value):
+
+        if obj._extra is None:
+            object.__setattr__(obj, '_extra', {})
+
+        obj._extra[self.name] = value
+
+
+class ExtraState(ExtraSlot):
+    """ Instance state of compact classes which have no slot for it (see
+        EXTRA_STATE): it defaults to the value of the Document class.
+    """
+
+    __slots__ = ('default',)
+
+    def __init__(self, name, default):
+        ExtraSlot.__init__(self, name)
+        self.default = default
+
+    def __get__(self, obj, type_=None):
+
+        if obj is None or obj._extra is None:
+            return self.default
+
+        return obj._extra.get(self.name, self.default)
+
+
+class ClassSchema(object):
+    """ Colander schema of a document class, built on first access: it is
+        the same for the class and its instances.
+    """
+
+    __slots__ = ()
+
+    def __get__(self, obj, type_=None):
+
+        cls = type(obj) if type_ is None else type_
+        schema = cls.__dict__.get('__schema_node__')
+        if schema is None:
+            schema = colander.SchemaNode(colander.Mapping(unknown='raise'))
+            for name in cls.__attrs__:
+                schema.add(cls.__attrs__[name])
+
+            type.__setattr__(cls, '__schema_node__', schema)
+
+        return schema
+
+
+class EmbeddedAttribute(Attribute):
+    """ Descriptor of embedded documents and lists: values loaded from the
+        database are kept raw and turned into documents on first access.
+    """
+
+    __slots__ = ('class_', 'raw_type')
+
+    deferrable = False
+
+    def __init__(self, name, slot, validate, class_, raw_type):
+        Attribute.__init__(self, name, slot, validate)
+        self.class_ = class_
+        self.raw_type = raw_type
+
+    def __get__(self, obj, type_=None):
+
+        if obj is None:
+            return self.query
+
+        value = self.get_raw(obj)
+        if value is unassigned or value is unloaded:
+            raise self.missing(obj, value)
+
+        if type(value) is self.raw_type:
+            value = self.hydrate(value)
+            self.set_raw(obj, value)
+
+        return value
+
+    def hydrate(self, value):
+
+        if self.raw_type is dict:
+            return self.class_.load(value)
+
+        return DocumentList(self.class_,
+                            [self.class_.load(params) for params in value])
+
+
+class ReferenceAttribute(Attribute):
+    """ Descriptor of references: the _ids are stored, the documents are
+        loaded on first access with the database which loaded obj (see
+        Document.prefetch) and kept in its _refs. Lists of references are
+        returned as tuples: assign a new list to change them.
+    """
+
+    __slots__ = ('class_', 'many')
+
+    deferrable = False
+
+    def __init__(self, name, slot, validate, class_, many):
+        Attribute.__init__(self, name, slot, validate)
+        self.class_ = class_
+        self.many = many
+
+    def __get__(self, obj, type_=None):
+
+        if obj is None:
+            return self.query
+
+        value = self.get_raw(obj)
+        if value is unassigned or value is unloaded:
+            raise self.missing(obj, value)
+
+        if value is None:
+            return None
+
+        refs = obj._refs
+        if refs is None or self.name not in refs:
+            self.resolve(obj, value)
+            refs = obj._refs
+
+        return refs[self.name]
+
+    def __set__(self, obj, value):
+
+        Attribute.__set__(self, obj, value)
+
+        if self.many and isinstance(value, (list, tuple)) and \
+           all(isinstance(item, self.class_) for item in value):
+            self.set_resolved(obj, tuple(value))
+
+        elif not self.many and isinstance(value, self.class_):
+            self.set_resolved(obj, value)
+
+        elif obj._refs is not None:
+            obj._refs.pop(self.name, None)
+
+    def resolve(self, obj, value):
+        """ Load the documents referenced by value, the stored _ids.
+        """
+
+        if obj._db is None:
+            msg = '{}.{} is not resolved: only documents returned by find ' \
+                  'and find_one load their references, use ' \
+                  'Document.prefetch for the others.'
+            raise FieldNotLoaded(msg.format(obj.__class__.__name__,
+                                            self.name))
+
+        obj.prefetch(obj._db, [obj], [self.name])
+        if obj._refs is None or self.name not in obj._refs:
+            msg = 'No result for: {}'.format({'_id': value})
+            raise NoResultFound(msg)
+
+    def set_resolved(self, obj, value):
+
+        if obj._refs is None:
+            object.__setattr__(obj, '_refs', {})
+
+        obj._refs[self.name] = value
+
+    def get_ids(self, obj):
+        """ Return the referenced _ids, an empty list if there are none.
+        """
+
+        value = self.get_raw(obj)
+        if value is unassigned or value is unloaded or value is None:
+            return []
+
+        return value if self.many else [value]
+
+
+def create_attribute(cls, field, slots=None):
+    """ Return the descriptor which handles field on cls instances, slots
+        are the ones returned by get_slots(cls).
+    """
+
+    validate = get_validator(cls, field)
+    slot = get_slot(cls, field.name, slots)
+
+    if isinstance(field, EmbeddedDocument):
+        return EmbeddedAttribute(field.name, slot, validate,
+                                 field.class_, dict)
+
+    if isinstance(field, EmbeddedList):
+        return EmbeddedAttribute(field.name, slot, validate,
+                                 field.class_, list)
+
+    if isinstance(field, (Reference, ReferenceList)):
+        return ReferenceAttribute(field.name, slot, validate, field.class_,
+                                  isinstance(field, ReferenceList))
+
+    return Attribute(field.name, slot, validate)
+
+
+def get_slot(cls, name, slots=None):
+    """ Return the member descriptor of the slot of field name in cls
+        instances, None if they keep it in their __dict__, an ExtraSlot if
+        they have neither (fields added to compact classes).
+    """
+
+    if slots is None:
+        slots = get_slots(cls)
+
+    if name in slots:
+        return slots[name]
+
+    return None if cls.__dictoffset__ else ExtraSlot(name)
+
+
+def get_slots(cls):
+    """ Return the member descriptors of the slots of cls instances, by name.
+    """
+
+    slots = {}
+    for class_ in reversed(cls.__mro__):
+        for name in get_slot_names(class_):
+            value = class_.__dict__.get(name)
+            # Class descriptors replace the member descriptors of the slots.
+            slots[name] = value.slot if isinstance(value, Attribute) else value
+
+    return slots
+
+
+def has_slot(cls, name):
+    return any(name in get_slot_names(class_) for class_ in cls.__mro__)
+
+
+def get_compact_slots(bases, attrs):
+    """ Return the __slots__ of a compact class: its fields and the instance
+        state which have no slot in its bases. Abstract classes have none,
+        so that they can be mixed with a concrete compact class.
+    """
+
+    if attrs.get('__abstract__'):
+        return ()
+
+    names = []
+    for base in bases:
+        names.extend(getattr(base, '__attrs__', ()))
+
+    names.extend(name for name in attrs if isinstance(attrs[name], Field))
+    names.extend(STATE + ('_extra',))
+
+    slots = []
+    for name in names:
+        if name not in slots and \
+           not any(has_slot(base, name) for base in bases):
+            slots.append(name)
+
+    return tuple(slots)
+
+
+def get_slotted_base(cls):
+    """ Return the nearest class of the MRO of cls, a document class, which
+        defines slots, None if there is none.
+    """
+
+    for class_ in cls.__mro__:
+        if isinstance(class_, DocumentMeta) and get_slot_names(class_):
+            return class_
+
+    return None
+
+
+def get_slot_names(class_):
+    """ Return the names of the slots defined by class_ itself.
+    """
+
+    slots = class_.__dict__.get('__slots__', ())
+    return (slots,) if isinstance(slots, str) else slots
+
+
+def get_validator(cls, field):
+    """ Return the method of cls which validates the values of field, timed
+        when an Instrumentation is set.
+    """
+
+    if isinstance(field, EmbeddedDocument):
+        method = 'validate_embedded_doc'
+
+    elif isinstance(field, EmbeddedList):
+        method = 'validate_embedded_list'
+
+    else:
+        method = 'validate_field'
+
+    validate = getattr(cls, method, None)
+    if validate is None or instrumentation is None:
+        return validate
+
+    hooks = instrumentation
+
+    def timed(obj, name, value):
+        start = time.perf_counter()
+        try:
+            return validate(obj, name, value)
+
+        finally:
+            hooks.validate(obj.__class__, name, method,
+                           time.perf_counter() - start)
+
+    return timed
+
+
+def get_indexes(cls, specs):
+    """ Return the Indexes declared by specs for cls, raise TypeError if
+        their keys are not fields of cls.
+    """
+
+    try:
+        indexes = [get_index(spec) for spec in specs]
+
+    except ValueError as e:
+        msg = 'Invalid __indexes__ of {}: {}'.format(cls.__name__, e)
+        raise TypeError(msg)
+
+    for index in indexes:
+        for name, direction in index.keys:
+            if name.split('.')[0] not in cls.__attrs__:
+                msg = 'Invalid __indexes__ of {}: {} is not a field.'
+                raise TypeError(msg.format(cls.__name__, name))
+
+    return indexes
+
+
+class Instrumentation(object):
+    """ Receiver of the events of mongobag, installed by
+        set_instrumentation: durations are in seconds. These methods do
+        nothing, subclasses override the ones they need.
+    """
+
+    def validate(self, class_, name, method, duration):
+        """ A value of field name was validated by method (validate_field,
+            validate_embedded_doc or validate_embedded_list).
+        """
+
+    def deserialize(self, class_, candidates, duration):
+        """ class_.deserialize built a document trying candidates classes.
+        """
+
+    def serialize(self, class_, duration):
+        """ A document of class_ was serialized: serializations served by
+            the cache are not counted.
+        """
+
+    def call(self, class_, collection, method, duration):
+        """ A method of collection was called for class_: the duration of
+            find is the time spent waiting the documents of the cursor.
+        """
+
+
+class Metrics(Instrumentation):
+    """ Instrumentation which counts the events and sums their durations
+        by (event, class name, detail): detail is the validation method,
+        'collection.method' for calls, None for the other events.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.durations = collections.Counter()
+        self.candidates = collections.Counter()
+
+    def add(self, key, duration):
+        self.counts[key] += 1
+        self.durations[key] += duration
+
+    def validate(self, class_, name, method, duration):
+        self.add(('validate', class_.__name__, method), duration)
+
+    def deserialize(self, class_, candidates, duration):
+        self.add(('deserialize', class_.__name__, None), duration)
+        self.candidates[class_.__name__] += candidates
+
+    def serialize(self, class_, duration):
+        self.add(('serialize', class_.__name__, None), duration)
+
+    def call(self, class_, collection, method, duration):
+        detail = '{}.{}'.format(collection, method)
+        self.add(('call', class_.__name__, detail), duration)
+
+
+def set_instrumentation(hooks):
+    """ Send the events of every document class to hooks, an
+        Instrumentation, None to stop sending them. Return the previous
+        one. Without instrumentation nothing is timed.
+    """
+
+    global instrumentation
+    previous = instrumentation
+    instrumentation = hooks
+
+    # Validators are timed by wrapping them in the descriptors.
+    for class_ in [Document] + Document.__all_subclasses__():
+        for attribute in class_.__layout__:
+            field = class_.__attrs__[attribute.name]
+            attribute.validate = get_validator(class_, field)
+
+    return previous
+
+
+@contextlib.contextmanager
+def deferred_validation():
+    """ Context in which values assigned to the fields of documents are not
+        validated, as if their classes had __deferred__ = True.
+    """
+
+    use_deferred_validation()
+    token = deferring.set(True)
+    try:
+        yield
+
+    finally:
+        deferring.reset(token)
+
+
+def use_deferred_validation():
+    """ Check the fields of documents for pending values from now on.
+    """
+
+    global deferred
+    deferred = True
+
+
+def call_collection(class_, collection, method, *args, **kwargs):
+    """ Call method of collection, timed when an Instrumentation is set.
+    """
+
+    function = getattr(collection, method)
+    hooks = instrumentation
+    if hooks is None:
+        return function(*args, **kwargs)
+
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+
+    finally:
+        hooks.call(class_, collection.name, method,
+                   time.perf_counter() - start)
+
+
+async def acall_collection(class_, collection, method, *args, **kwargs):
+
+    function = getattr(collection, method)
+    hooks = instrumentation
+    if hooks is None:
+        return await function(*args, **kwargs)
+
+    start = time.perf_counter()
+    try:
+        return await function(*args, **kwargs)
+
+    finally:
+        hooks.call(class_, collection.name, method,
+                   time.perf_counter() - start)
+
+
+def iter_timed(class_, collection, cursor):
+    """ Yield the documents of cursor, reporting the time spent waiting
+        them as a find call when the iteration ends.
+    """
+
+    hooks = instrumentation
+    iterator = iter(cursor)
+    duration = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                doc = next(iterator)
+
+            except StopIteration:
+                return
+
+            finally:
+                duration += time.perf_counter() - start
+
+            yield doc
+
+    finally:
+        hooks.call(class_, collection.name, 'find', duration)
+
+
+async def aiter_timed(class_, collection, cursor):
+
+    hooks = instrumentation
+    iterator = cursor.__aiter__()
+    duration = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                doc = await iterator.__anext__()
+
+            except StopAsyncIteration:
+                return
+
+            finally:
+                duration += time.perf_counter() - start
+
+            yield doc
+
+    finally:
+        hooks.call(class_, collection.name, 'find', duration)
+
+
 class DocumentMeta(type):
 
     def __new__(cls, name, bases, attrs):
@@ -31,10 +707,43 @@ class DocumentMeta(type):
         _ABSTRACT = '__abstract__'  # identify no persistent document class.
         _COLLECTION = '__collection__'  # collection name/object of the document.
         _SCHEMA = '__schema__'  # Colander schema object.
+        _DISCRIMINATOR = '__discriminator__'  # key storing the type tag.
+        _IDENTITY = '__identity__'  # type tag of the document class.
+        _COMPACT = '__compact__'  # instances have no __dict__.
 
         if _ABSTRACT not in attrs:
             attrs[_ABSTRACT] = False
 
+        compact = attrs.get(_COMPACT,
+                            any(getattr(base, _COMPACT, False)
+                                for base in bases))
+        slotted = None  # most derived base class defining slots.
+        for base in bases:
+            other = get_slotted_base(base)
+            if other is None or slotted is not None and \
+               issubclass(slotted, other):
+                continue
+
+            if slotted is not None and not issubclass(other, slotted):
+                # Python cannot lay out instances with both sets of slots.
+                msg = 'Cannot mix {} and {} in {}: both are concrete ' \
+                      'compact classes, make one of them abstract or not ' \
+                      'compact.'
+                raise TypeError(msg.format(slotted.__name__, other.__name__,
+                                           name))
+
+            slotted = other
+
+        namespace = attrs
+        if compact and '__slots__' not in attrs:
+            # Fields get slots, which replace them in the namespace: the
+            # descriptors of __init__ use their member descriptors.
+            slots = get_compact_slots(bases, attrs)
+            namespace = {key: value
+                         for key, value in attrs.items()
+                         if key not in slots}
+            namespace['__slots__'] = slots
+
         if len([base
                 for base in bases
                 if isinstance(base, cls) and \
@@ -42,10 +751,12 @@ class DocumentMeta(type):
             msg = 'Multiple base classes of {} define {}.'
             warnings.warn(msg.format(name, _COLLECTION), SyntaxWarning)
 
-        class_ = type.__new__(cls, name, bases, attrs)
+        class_ = type.__new__(cls, name, bases, namespace)
         type.__setattr__(class_, '_ABSTRACT', _ABSTRACT)
         type.__setattr__(class_, '_COLLECTION', _COLLECTION)
         type.__setattr__(class_, '_SCHEMA', _SCHEMA)
+        type.__setattr__(class_, '_DISCRIMINATOR', _DISCRIMINATOR)
+        type.__setattr__(class_, '_IDENTITY', _IDENTITY)
 
         return class_
 
@@ -55,6 +766,9 @@ class DocumentMeta(type):
 
         abstract = getattr(cls, cls._ABSTRACT)
 
+        if getattr(cls, '__deferred__', False):
+            use_deferred_validation()
+
         if not abstract and getattr(cls, cls._COLLECTION, None) is None:
             # Add a default name for documents collection.
             # MongoBag use this name to load the pymongo collection obj.
@@ -63,13 +777,29 @@ class DocumentMeta(type):
         if not abstract and getattr(cls, '_id', None) is None:
             raise TypeError('Not abstract classes must have an _id field.')
 
-        # Create a colander schema of the document.
-        schema = colander.SchemaNode(colander.Mapping(unknown='raise'))
-        type.__setattr__(cls, cls._SCHEMA, schema)
+        if cls._IDENTITY not in attrs:
+            type.__setattr__(cls, cls._IDENTITY, cls.__name__)
+
+        if cls._DISCRIMINATOR in attrs:
+            # Root of a tagged hierarchy: subclasses share its registry.
+            type.__setattr__(cls, '__registry__', {})
+
+        if getattr(cls, cls._DISCRIMINATOR, None) is not None:
+            identity = getattr(cls, cls._IDENTITY)
+            registry = cls.__registry__
+            if identity in registry:
+                msg = 'Classes {} and {} have the same identity: {}.'
+                msg = msg.format(registry[identity].__name__, name, identity)
+                raise TypeError(msg)
+
+            registry[identity] = cls
+
+        # The colander schema of the document is built on first access.
         type.__setattr__(cls, '__attrs__', {})
         type.__setattr__(cls, '__fields__', {})
         type.__setattr__(cls, '__embedded_docs__', {})
         type.__setattr__(cls, '__embedded_lists__', {})
+        type.__setattr__(cls, '__validators__', {})
 
         for base in bases:
             try:
@@ -82,18 +812,20 @@ class DocumentMeta(type):
                 continue
 
             else:
+                # Inherited fields and their validators are shared.
                 for name in base_attrs:
-                    attr = base_attrs[name].clone()
-                    cls.__attrs__[attr.name] = attr
+                    attr = base_attrs[name]
+                    cls.__attrs__[name] = attr
 
-                    if attr.name in base_fields:
-                        cls.__fields__[attr.name] = attr
+                    if name in base_fields:
+                        cls.__fields__[name] = attr
+                        cls.__validators__[name] = base.__validators__[name]
 
-                    if attr.name in base_embedded_docs:
-                        cls.__embedded_docs__[attr.name] = attr
+                    if name in base_embedded_docs:
+                        cls.__embedded_docs__[name] = attr
 
-                    if attr.name in base_embedded_lists:
-                        cls.__embedded_lists__[attr.name] = attr
+                    if name in base_embedded_lists:
+                        cls.__embedded_lists__[name] = attr
 
         for name in attrs:
 
@@ -113,31 +845,65 @@ class DocumentMeta(type):
 
             else:
                 cls.__fields__[name] = attr
+                cls.__validators__[name] = attr.compile()
 
-        schema = getattr(cls, cls._SCHEMA)
-        for name in cls.__attrs__:
-            schema.add(cls.__attrs__[name])
-
-        # Replace fields with MongoQ objects:
+        # Replace fields with descriptors returning MongoQ objects:
         # user can perform query using the style MyClass.attr == value
         # instead of Mongo syntax.
+        type.__setattr__(cls, '__layout__', [])
+        slots = get_slots(cls)
         for name in cls.__attrs__:
-            type.__setattr__(cls, name, getattr(mongoq.Q, name))
+            attribute = create_attribute(cls, cls.__attrs__[name], slots)
+            cls.__layout__.append(attribute)
+            type.__setattr__(cls, name, attribute)
+
+        # Compact classes keep the state rarely set in their _extra dict.
+        state = STATE + ('_extra',) if '_extra' in slots else STATE
+        type.__setattr__(cls, '__state__', state)
+        for name in EXTRA_STATE:
+            if not abstract and \
+               isinstance(get_slot(cls, name, slots), ExtraSlot):
+                state = ExtraState(name, getattr(Document, name))
+                type.__setattr__(cls, name, state)
+
+        if '__indexes__' in attrs:
+            type.__setattr__(cls, '__indexes__',
+                             get_indexes(cls, attrs['__indexes__']))
+
+        # Subclasses are added to the descendants of every base class and
+        # removed when they are garbage collected.
+        type.__setattr__(cls, '__descendants__', [])
+        for base in cls.__mro__[1:]:
+            if isinstance(base, DocumentMeta):
+                descendants = base.__descendants__
+                descendants.append(weakref.ref(cls, descendants.remove))
 
     def __setattr__(cls, name, value):
 
+        if name == '__deferred__' and value:
+            use_deferred_validation()
+
         if not isinstance(value, Field) and name in cls.__attrs__:
             raise AttributeError('Attribute value must be a Field instance.')
 
+        elif name == '__indexes__':
+            return type.__setattr__(cls, name, get_indexes(cls, value))
+
         elif not isinstance(value, Field):
             return type.__setattr__(cls, name, value)
 
         value.name = name
+        embedded = isinstance(value, (EmbeddedDocument, EmbeddedList))
+        validator = None if embedded else value.compile()
 
+        # The field and its validator are shared by the subclasses.
         for class_ in [cls] + cls.__all_subclasses__():
 
-            if class_ != cls:
-                value = value.clone()
+            for registry in (class_.__fields__,
+                             class_.__validators__,
+                             class_.__embedded_docs__,
+                             class_.__embedded_lists__):
+                registry.pop(name, None)
 
             class_.__attrs__[name] = value
 
@@ -148,31 +914,56 @@ class DocumentMeta(type):
                 class_.__embedded_lists__[name] = value
 
             else:
-                class_.__fields__[name] = value                
+                class_.__fields__[name] = value
+                class_.__validators__[name] = validator
 
-            schema = getattr(class_, class_._SCHEMA)
-            schema.add(value)
+            if '__schema_node__' in class_.__dict__:
+                # Rebuilt with the new field on next access.
+                type.__delattr__(class_, '__schema_node__')
 
-        # Set mongoq.Query instead of field in the parent class only!
-        type.__setattr__(class_, name, getattr(mongoq.Q, name))
+            # Slots differ between classes: each one needs a descriptor.
+            attribute = create_attribute(class_, value)
+            layout = class_.__layout__
+            layout[:] = [a for a in layout if a.name != name] + [attribute]
+            type.__setattr__(class_, name, attribute)
 
     def __all_subclasses__(cls):
-        subclasses = cls.__subclasses__()
-        return subclasses + [g for s in subclasses
-                               for g in s.__all_subclasses__()]
+        """ Return the subclasses of cls at any depth, in creation order.
+        """
+        return [class_ for class_ in (ref() for ref in cls.__descendants__)
+                if class_ is not None]
 
 
 class Document(object, metaclass=DocumentMeta):
 
     __abstract__ = True
+    __compact__ = False  # instances keep fields in slots, no __dict__.
+    __discriminator__ = None
+    __trusted__ = False  # find and find_one load documents without validation.
+    __deferred__ = False  # fields are validated by validate(), not on set.
+    __explain__ = False  # find and find_one warn about collection scans.
+    __indexes__ = []  # Index objects, or their keys, created by ensure_indexes.
+    __schema__ = ClassSchema()  # colander schema, built on first access.
+    __slots__ = ()
     _id = ObjectId(missing=colander.null, default=colander.null)
 
+    # Instance state, see STATE and EXTRA_STATE.
+    _dirty = None  # names of the changed fields, None if not tracked.
+    _serialized = None  # cached serialization.
+    _db = None  # database loading the references.
+    _refs = None  # referenced documents, by field name.
+    _pending = False  # some values were set without validation.
+    _extra = None  # fields added to compact classes after their creation.
+
     def __init__(self, **kwargs):
 
-        for name in self.__attrs__:
-            value = kwargs.pop(name, colander.null)
+        for name in self.__state__:
+            object.__setattr__(self, name, None)
+
+        for attribute in self.__layout__:
+            value = kwargs.pop(attribute.name, colander.null)
             try:
-                setattr(self, name, value)
+                attribute.__set__(self, value)
 
             except DocumentAttributeError as e:
                 raise DocumentTypeError(str(e))
@@ -187,23 +978,48 @@ class Document(object, metaclass=DocumentMeta):
             msg = '{}.{} is not defined'.format(self.__class__.__name__, name)
             raise DocumentAttributeError(msg)
 
-        elif name in self.__fields__:
-            value = self.validate_field(name, value)
+        # The descriptor of the field validates the value.
+        object.__setattr__(self, name, value)
 
-        elif name in self.__embedded_docs__:
-            value = self.validate_embedded_doc(name, value)
+    def __getstate__(self):
 
-        elif name in self.__embedded_lists__:
-            value = self.validate_embedded_list(name, value)
+        values = {}
+        unloaded_ = []
+        for attribute in self.__layout__:
+            value = attribute.get_raw(self)
+            if value is unloaded:
+                unloaded_.append(attribute.name)
 
-        object.__setattr__(self, name, value)
+            elif value is not colander.null:
+                values[attribute.name] = value
+
+        return values, self._dirty, unloaded_
+
+    def __setstate__(self, state):
+
+        values, dirty, unloaded_ = state
+        for name in self.__state__:
+            object.__setattr__(self, name, None)
+
+        for attribute in self.__layout__:
+            if attribute.name in values:
+                attribute.set_raw(self, values[attribute.name])
+
+            elif attribute.name in unloaded_:
+                attribute.set_raw(self, unloaded)
+
+        if dirty is not None and not dirty:
+            dirty = clean
+
+        object.__setattr__(self, '_dirty', dirty)
 
     def validate_field(self, name, value):
 
-        cstruct = str(value) if value != colander.null else value
+        if value is None:
+            value = colander.null
 
         try:
-            value = getattr(self, self._SCHEMA)[name].deserialize(cstruct)
+            value = self.__validators__[name](value)
 
         except colander.Invalid as e:
             raise DocumentAttributeError(str(e))
@@ -228,8 +1044,15 @@ class Document(object, metaclass=DocumentMeta):
             except colander.Invalid as e:
                 raise DocumentAttributeError(str(e))
 
-            else:
-                return value if value != colander.null else None
+            if isinstance(value, dict):
+                # missing value given as the params of the document.
+                try:
+                    value = schema.class_.deserialize(**value)
+
+                except DocumentTypeError as e:
+                    raise DocumentAttributeError(str(e))
+
+            return value if value != colander.null else None
 
         msg = 'Cannot set {}.{} to {}: invalid value.'
         msg = msg.format(self.__class__.__name__,
@@ -251,9 +1074,19 @@ class Document(object, metaclass=DocumentMeta):
             except colander.Invalid as e:
                 raise DocumentAttributeError(str(e))
 
-            else:
-                default = DocumentList(schema.class_, [])
-                return value if value != colander.null else default
+            if value is colander.null:
+                return DocumentList(schema.class_, [])
+
+            if callable(value):
+                value = value()
+
+            try:
+                return DocumentList(schema.class_,
+                                    [schema.class_.deserialize(**params)
+                                     for params in value])
+
+            except DocumentTypeError as e:
+                raise DocumentAttributeError(str(e))
 
         if not isinstance(value, list):
             msg = 'Cannot set {}.{} to {}: it is not a list.'
@@ -276,7 +1109,65 @@ class Document(object, metaclass=DocumentMeta):
     @classmethod
     def deserialize(cls, **kwargs):
 
-        for name in cls.__embedded_docs__:
+        hooks = instrumentation
+        start = time.perf_counter() if hooks is not None else 0.0
+
+        discriminator = getattr(cls, cls._DISCRIMINATOR, None)
+        identity = kwargs.pop(discriminator, None) if discriminator else None
+
+        if identity is not None:
+            class_ = cls.__registry__.get(identity)
+            if class_ is None or not issubclass(class_, cls):
+                msg = 'Cannot deserialize {} using {}: unknown type {}.'
+                msg = msg.format(cls.__name__, kwargs, identity)
+                raise DocumentTypeError(msg)
+
+            obj = class_(**class_._deserialize_embedded(kwargs))
+            if obj._pending:
+                obj.validate()
+
+            if hooks is not None:
+                hooks.deserialize(cls, 1, time.perf_counter() - start)
+
+            return obj
+
+        kwargs = cls._deserialize_embedded(kwargs)
+
+        classes = [cls] + cls.__all_subclasses__()
+        candidates = []
+        for class_ in classes:
+            try:
+                obj = class_(**kwargs)
+                if obj._pending:
+                    # Deferred validation accepts any value.
+                    obj.validate()
+
+            except DocumentTypeError:
+                continue
+
+            candidates.append(obj)
+
+        if len(candidates) > 1:
+            msg = 'Cannot deserialize {} using {}: too many candidates.'
+            msg = msg.format(cls.__name__, kwargs)
+            raise DocumentTypeError(msg)
+
+        if not candidates:
+            msg = 'Cannot deserialize {} using {}: no candidates.'
+            msg = msg.format(cls.__name__, kwargs)
+            raise DocumentTypeError(msg)
+
+        if hooks is not None:
+            hooks.deserialize(cls, len(classes), time.perf_counter() - start)
+
+        return candidates[0]
+
+    @classmethod
+    def _deserialize_embedded(cls, kwargs):
+        """ Replace embedded documents and lists in kwargs with Documents.
+        """
+
+        for name in cls.__embedded_docs__:
             schema = cls.__embedded_docs__[name]
             params = kwargs.pop(name, colander.null)
             if params is colander.null or params is None:
@@ -294,89 +1185,1693 @@ class Document(object, metaclass=DocumentMeta):
                                         [schema.class_.deserialize(**params)
                                          for params in values])
 
-        candidates = []
-        for class_ in [cls] + cls.__all_subclasses__():
+        return kwargs
+
+    @classmethod
+    def load(cls, doc, fields=None):
+        """ Build a document from a dict stored in the database.
+
+            Values are trusted: they are set without validation, call
+            validate() to check the document. Documents with keys which
+            are not fields of their class (e.g. untagged documents of a
+            subclass) are built by deserialize, which finds their class or
+            raises DocumentTypeError: their values are never dropped.
+            Embedded documents and lists are loaded on first access.
+            When fields is given, the other fields are not loaded.
+        """
+
+        discriminator = getattr(cls, cls._DISCRIMINATOR, None)
+        identity = doc.get(discriminator) if discriminator else None
+        class_ = cls
+
+        if identity is not None:
+            class_ = cls.__registry__.get(identity)
+            if class_ is None or not issubclass(class_, cls):
+                msg = 'Cannot load {} using {}: unknown type {}.'
+                msg = msg.format(cls.__name__, doc, identity)
+                raise DocumentTypeError(msg)
+
+        obj = object.__new__(class_)
+        for name in class_.__state__:
+            object.__setattr__(obj, name, None)
+
+        known = 0  # values of fields found in doc.
+        missing = []  # validated fields without value.
+        for attribute in class_.__layout__:
+            name = attribute.name
+            if fields is None or name in fields or name == '_id':
+                value = doc.get(name, colander.null)
+                if value is not colander.null:
+                    known += 1
+
+                elif attribute.validate is not None:
+                    missing.append(attribute)
+
+            else:
+                value = unloaded
+
+            # Embedded documents and lists are stored raw: the descriptors
+            # load them on first access.
+            if attribute.slot is None:
+                object.__setattr__(obj, attribute.key, value)
+
+            else:
+                attribute.slot.__set__(obj, value)
+
+        if len(doc) > known + (identity is not None):
+            # Some keys are not fields of class_.
+            return cls._load_unknown(doc, fields)
+
+        for attribute in missing:
+            # Let the validators compute missing values.
             try:
-                candidates.append(class_(**kwargs))
+                value = attribute.validate(obj, attribute.name, colander.null)
 
-            except DocumentTypeError:
-                continue
+            except DocumentAttributeError as e:
+                raise DocumentTypeError(str(e))
 
-        if len(candidates) > 1:
-            msg = 'Cannot deserialize {} using {}: too many candidates.'
-            msg = msg.format(cls.__name__, kwargs)
-            raise DocumentTypeError(msg)
+            attribute.set_raw(obj, value)
 
-        if not candidates:
-            msg = 'Cannot deserialize {} using {}: no candidates.'
-            msg = msg.format(cls.__name__, kwargs)
+        object.__setattr__(obj, '_dirty', clean)
+        return obj
+
+    @classmethod
+    def _load_unknown(cls, doc, fields):
+        """ Load doc, which has keys that are not fields of its class: whole
+            documents are deserialized, projected ones are loaded as the
+            most generic class which has all their keys.
+        """
+
+        if fields is None:
+            obj = cls.deserialize(**doc)
+            obj._reset_changes()
+            return obj
+
+        discriminator = getattr(cls, cls._DISCRIMINATOR, None)
+        candidates = [class_
+                      for class_ in [cls] + cls.__all_subclasses__()
+                      if all(key in class_.__attrs__ or key == discriminator
+                             for key in doc)]
+        candidates = [class_
+                      for class_ in candidates
+                      if not any(other is not class_ and
+                                 issubclass(class_, other)
+                                 for other in candidates)]
+        if len(candidates) != 1:
+            msg = 'Cannot load {} using {}: {} candidates.'
+            msg = msg.format(cls.__name__, doc, len(candidates) or 'no')
             raise DocumentTypeError(msg)
 
-        return candidates[0]
+        return candidates[0].load(doc, fields)
+
+    def is_partial(self):
+        """ Return True if some fields were excluded by a projection or if
+            a window of some embedded lists is loaded.
+        """
+
+        for attribute in self.__layout__:
+            value = attribute.get_raw(self)
+            if value is unloaded or \
+               (isinstance(value, DocumentList) and value.window is not None):
+                return True
+
+        return False
+
+    def load_window(self, db, field, window):
+        """ Load window (see find) of the embedded list field in place of
+            the loaded items, and return them. Raise DocumentTypeError if
+            the loaded items have changes which are not saved.
+        """
+
+        name = field if isinstance(field, str) else field.field
+        attribute = self._get_list_attribute(name)
+        window = get_slice(window)
+        current = attribute.get_raw(self)
+        if isinstance(current, DocumentList):
+            changes = {'$set': {}, '$unset': {}, '$push': {}}
+            current.collect_changes(name, changes)
+            if any(changes.values()):
+                msg = 'Cannot load a window of {}.{}: save its changes first.'
+                raise DocumentTypeError(msg.format(self.__class__.__name__,
+                                                   name))
+
+        # Exclude the other fields: $slice cannot be used with inclusions
+        # by every server version.
+        projection = {other: 0 for other in self.__attrs__
+                      if other not in (name, '_id')}
+        projection[name] = {'$slice': window}
+        collection = self.get_collection(db)
+        doc = call_collection(self.__class__, collection, 'find_one',
+                              {'_id': self._id}, projection)
+        if doc is None:
+            msg = 'No result for: {}'.format({'_id': self._id})
+            raise NoResultFound(msg)
+
+        items = attribute.hydrate(doc.get(name) or [])
+        items.set_window(window)
+        items.reset_changes()
+        attribute.set_raw(self, items)
+        return items
+
+    def _get_list_attribute(self, name):
+
+        if name not in self.__embedded_lists__:
+            msg = '{} is not an embedded list of {}.'
+            raise DocumentAttributeError(msg.format(name,
+                                                    self.__class__.__name__))
+
+        for attribute in self.__layout__:
+            if attribute.name == name:
+                return attribute
+
+    def push(self, db, field, *docs):
+        """ Append docs to the embedded list field with $push, without
+            loading it: the loaded list gets them too unless it is partial.
+            Return the pymongo result.
+        """
+
+        name = field if isinstance(field, str) else field.field
+        attribute = self._get_list_attribute(name)
+        if self._id is None:
+            msg = 'Cannot update {}: it has no _id.'
+            raise DocumentTypeError(msg.format(self.__class__.__name__))
+
+        class_ = self.__embedded_lists__[name].class_
+        values = []
+        for doc in docs:
+            if not isinstance(doc, class_):
+                msg = 'Object {} must be an instance of {}.'
+                raise DocumentTypeError(msg.format(doc, class_.__name__))
+
+            if doc._is_pending():
+                doc.validate()
+
+            values.append(doc._serialize())
+
+        collection = self.get_collection(db)
+        result = call_collection(self.__class__, collection, 'update_one',
+                                 {'_id': self._id},
+                                 {'$push': {name: {'$each': values}}})
+        invalidate_queries(collection)
+
+        current = attribute.get_raw(self)
+        if isinstance(current, DocumentList) and current.window is None:
+            # Already stored: not pushed again by update.
+            list.extend(current, docs)
+            current.serialized = None
+
+        elif type(current) is list:
+            current.extend(values)
+
+        for doc in docs:
+            doc._reset_changes()
+
+        return result
+
+    def reload(self, db):
+        """ Load the fields which were excluded by a projection.
+        """
+
+        attributes = [attribute
+                      for attribute in self.__layout__
+                      if attribute.get_raw(self) is unloaded]
+
+        if not attributes:
+            return self
+
+        collection = self.get_collection(db)
+        doc = call_collection(self.__class__, collection, 'find_one',
+                              {'_id': self._id},
+                              {attribute.name: 1 for attribute in attributes})
+        if doc is None:
+            msg = 'No result for: {}'.format({'_id': self._id})
+            raise NoResultFound(msg)
+
+        for attribute in attributes:
+            value = doc.get(attribute.name, colander.null)
+            if value is colander.null:
+                try:
+                    value = attribute.validate(self, attribute.name, value)
+
+                except DocumentAttributeError as e:
+                    raise DocumentTypeError(str(e))
+
+            attribute.set_raw(self, value)
+
+        return self
+
+    def validate(self):
+        """ Validate all the values of the document and of its embedded
+            documents, then call their validate_document. Raise
+            ValidationError, with the errors of all the invalid fields, if
+            some of them are invalid.
+        """
+
+        errors = {}
+        self._collect_errors('', errors)
+        if errors:
+            msg = '{} is not valid: {}'.format(
+                self.__class__.__name__,
+                '; '.join('{}: {}'.format(name or self.__class__.__name__,
+                                          error)
+                          for name, error in errors.items()))
+            raise ValidationError(msg, errors)
+
+        return self
+
+    def validate_document(self):
+        """ Check the values which depend on each other, called by validate
+            when all the fields are valid: raise DocumentAttributeError, or
+            ValidationError with the errors by field name, if they are not
+            valid. This method does nothing, subclasses override it.
+        """
+
+    def _collect_errors(self, prefix, errors):
+        """ Validate the document, adding the errors to errors by path.
+        """
+
+        count = len(errors)
+        for attribute in self.__layout__:
+            if attribute.get_raw(self) is unloaded:
+                continue
+
+            if type(attribute) is EmbeddedAttribute:
+                value = getattr(self, attribute.name, colander.null)
+
+            else:
+                # References are validated without loading the documents.
+                value = attribute.get_raw(self)
+
+            if value is None:
+                value = colander.null
+
+            try:
+                value = attribute.validate(self, attribute.name, value)
+
+            except DocumentAttributeError as e:
+                errors[prefix + attribute.name] = str(e)
+                continue
+
+            # Validation does not change the document: no dirty fields.
+            attribute.set_raw(self, value)
+
+        for name in self.__embedded_docs__:
+            value = getattr(self, name, None)
+            if isinstance(value, Document):
+                value._collect_errors('{}{}.'.format(prefix, name), errors)
+
+        for name in self.__embedded_lists__:
+            for index, obj in enumerate(getattr(self, name, None) or []):
+                obj._collect_errors('{}{}.{}.'.format(prefix, name, index),
+                                    errors)
+
+        if len(errors) > count:
+            return
+
+        try:
+            self.validate_document()
+
+        except ValidationError as e:
+            errors.update(('{}{}'.format(prefix, name) if name else
+                           prefix[:-1] or None, error)
+                          for name, error in e.errors.items())
+
+        except DocumentAttributeError as e:
+            errors[prefix[:-1] or None] = str(e)
+
+        else:
+            object.__setattr__(self, '_pending', False)
+
+    def _is_pending(self):
+        """ Return True if values were set without validation in the
+            document or in its loaded embedded documents.
+        """
+
+        if not deferred:
+            return False
+
+        if self._pending:
+            return True
+
+        for attribute in self.__layout__:
+            value = attribute.get_raw(self)
+            if isinstance(value, Document) and value._is_pending():
+                return True
+
+            if isinstance(value, DocumentList) and \
+               any(obj._is_pending() for obj in value):
+                return True
+
+        return False
+
+    @classmethod
+    def get_collection(cls, db):
+        """ Return the pymongo collection of the document.
+        """
+        return db[getattr(cls, cls._COLLECTION)]
+
+    @classmethod
+    def ensure_indexes(cls, db):
+        """ Create the indexes declared by cls and by its subclasses, by
+            every document class when cls is Document. Existing indexes
+            are left as they are: return the names of all of them.
+        """
+
+        names = []
+        created = set()
+        for class_ in [cls] + cls.__all_subclasses__():
+            if getattr(class_, class_._ABSTRACT):
+                continue
+
+            collection = class_.get_collection(db)
+            for index in class_.__indexes__:
+                if (collection.full_name, index) in created:
+                    continue
+
+                created.add((collection.full_name, index))
+                names.append(call_collection(class_, collection,
+                                             'create_index', index.keys,
+                                             **index.options))
+
+        clear_explained()
+        return names
+
+    @classmethod
+    def find_one(cls, db, criterion, *args, trusted=None, fields=None,
+                 session=None, cache=None, windows=None, **kwargs):
+        """ Return the first document matching criterion, raise
+            NoResultFound if there is none.
+
+            When a Session is given, lookups by _id are served by it and
+            documents already in the session are returned in place of the
+            loaded ones. When a QueryCache is given, the raw document is
+            taken from it and stored in it.
+            windows limits the loaded items of embedded lists, see find.
+        """
+
+        obj = cls._get_from_session(session, criterion)
+        if obj is not None:
+            return obj
+
+        if fields is not None:
+            fields, kwargs['projection'] = cls._get_projection(fields)
+
+        if windows is not None:
+            windows = cls._get_windows(windows)
+            fields = add_windows(windows, fields, kwargs)
+
+        collection = cls.get_collection(db)
+        key = cls._get_query_key(collection, 'find_one', cache, criterion,
+                                 (args, kwargs))
+        docs = None if key is None else cache.get(key)
+        if docs is None:
+            if cls.__explain__:
+                explain(cls, collection, criterion, *args, **kwargs)
+
+            docs = [call_collection(cls, collection, 'find_one',
+                                    criterion, *args, **kwargs)]
+            if key is not None:
+                cache.set(key, docs)
+
+        obj = cls._hydrate_one(docs[0], criterion, trusted, fields)
+        if windows is not None:
+            set_windows(obj, windows)
+
+        if has_references(cls):
+            object.__setattr__(obj, '_db', db)
+
+        return obj if session is None else session.add(obj)
+
+    @classmethod
+    async def afind_one(cls, db, criterion, *args, trusted=None, fields=None,
+                        session=None, cache=None, **kwargs):
+        """ Asynchronous find_one: db is a database of an asyncio driver
+            (e.g. motor) whose collection methods are coroutines.
+        """
+
+        obj = cls._get_from_session(session, criterion)
+        if obj is not None:
+            return obj
+
+        if fields is not None:
+            fields, kwargs['projection'] = cls._get_projection(fields)
+
+        collection = cls.get_collection(db)
+        key = cls._get_query_key(collection, 'find_one', cache, criterion,
+                                 (args, kwargs))
+        docs = None if key is None else cache.get(key)
+        if docs is None:
+            docs = [await acall_collection(cls, collection, 'find_one',
+                                           criterion, *args, **kwargs)]
+            if key is not None:
+                cache.set(key, docs)
+
+        obj = cls._hydrate_one(docs[0], criterion, trusted, fields)
+        return obj if session is None else session.add(obj)
+
+    @classmethod
+    def _get_query_key(cls, collection, method, cache, criterion, options):
+
+        if cache is None:
+            return None
+
+        return get_query_key(collection, method, criterion, options)
+
+
+    @classmethod
+    def _get_from_session(cls, session, criterion):
+
+        if session is None:
+            return None
+
+        id_ = get_criterion_id(criterion)
+        if id_ is None:
+            return None
+
+        return session.get(cls, id_)
 
     @classmethod
-    def find_one(cls, db, criterion, *args, **kwargs):
-        doc = db[cls._COLLECTION].find_one(criterion, *args, **kwargs)
+    def _hydrate_one(cls, doc, criterion, trusted, fields):
+
         if doc is None:
             msg = 'No result for: {}'.format(criterion)
             raise NoResultFound(msg)
 
-        return cls.deserialize(**doc) if doc else None
+        return cls._hydrate(doc, trusted, fields)
+
+    @classmethod
+    def find(cls, db, criterion, trusted=None, fields=None, executor=None,
+             batch_size=1000, max_pending=4, session=None, cache=None,
+             prefetch=True, windows=None, **kwargs):
+        """ Return a generator of the documents matching criterion.
+
+            Documents are validated unless trusted is True (default is
+            __trusted__), fields is a list of fields (e.g. [Page.title])
+            which limits the loaded ones: the others raise FieldNotLoaded.
+            Validation builds every embedded document and list: only
+            trusted documents load them on first access (see load), the
+            validated ones gain nothing from reading a few fields.
+
+            When an executor (e.g. a ProcessPoolExecutor) is given, batches
+            of batch_size documents are hydrated by its workers: at most
+            max_pending batches are waiting, documents keep their order.
+
+            When a Session is given, documents already in the session are
+            returned in place of the loaded ones and the others are added.
+            When a QueryCache is given, the raw documents are taken from it
+            and stored in it.
+
+            References are loaded every batch_size documents with one
+            query by referenced class: prefetch limits them to a list of
+            references (e.g. [Member.groups]). When prefetch is False they
+            are loaded on first access, one query each.
+
+            windows maps embedded lists (names, or mongoq fields in a list
+            of pairs) to the window of items loaded by $slice: n for the
+            first n items, -n for the last n, (skip, limit) for limit items
+            after skip. These lists are partial: items can be appended and
+            changed, but not removed, inserted or reordered. Documents with
+            partial lists cannot replace the stored ones, load_window loads
+            other items and push appends items without loading them.
+        """
+
+        if windows is not None:
+            windows = cls._get_windows(windows)
+
+        docs = cls._find(db, criterion, trusted, fields, executor,
+                         batch_size, max_pending, cache, windows, **kwargs)
+        if windows is not None:
+            docs = (set_windows(obj, windows) for obj in docs)
+
+        if session is not None:
+            docs = (session.add(obj) for obj in docs)
+
+        if not has_references(cls):
+            return docs
+
+        if prefetch is False:
+            return iter_referencing(db, docs)
+
+        fields = None if prefetch is True else prefetch
+        return iter_prefetched(db, docs, fields, batch_size, session, cache)
+
+    @classmethod
+    def _find(cls, db, criterion, trusted, fields, executor,
+              batch_size, max_pending, cache, windows, **kwargs):
+
+        if fields is not None:
+            fields, kwargs['projection'] = cls._get_projection(fields)
+
+        if windows is not None:
+            fields = add_windows(windows, fields, kwargs)
+
+        collection = cls.get_collection(db)
+        key = cls._get_query_key(collection, 'find', cache, criterion, kwargs)
+        cursor = None if key is None else cache.get(key)
+        if cursor is None:
+            if cls.__explain__:
+                explain(cls, collection, criterion, **kwargs)
+
+            cursor = collection.find(criterion, **kwargs)
+            if executor is not None:
+                cursor.batch_size(batch_size)
+
+            if instrumentation is not None:
+                cursor = iter_timed(cls, collection, cursor)
+
+            if key is not None:
+                cursor = cache.set_cursor(key, cursor)
+
+        if executor is None:
+            for doc in cursor:
+                yield cls._hydrate(doc, trusted, fields)
+
+            return
+
+        batches = hydrate_batches(cls, iter_batches(cursor, batch_size),
+                                  trusted, fields, executor, max_pending)
+        try:
+            for batch in batches:
+                for obj in batch:
+                    yield obj
+
+        finally:
+            batches.close()
+
+    @classmethod
+    async def afind(cls, db, criterion, trusted=None, fields=None,
+                    session=None, cache=None, **kwargs):
+        """ Asynchronous find: return an async generator of documents, the
+            cursor of the asyncio driver must support async for. References
+            are not loaded on access: db is asynchronous.
+        """
+
+        if fields is not None:
+            fields, kwargs['projection'] = cls._get_projection(fields)
+
+        collection = cls.get_collection(db)
+        key = cls._get_query_key(collection, 'find', cache, criterion, kwargs)
+        docs = None if key is None else cache.get(key)
+        cursor = None
+        if docs is None:
+            cursor = collection.find(criterion, **kwargs)
+            if instrumentation is not None:
+                cursor = aiter_timed(cls, collection, cursor)
+
+        if key is not None and docs is None:
+            docs = []
+            async for doc in cursor:
+                docs.append(doc)
+                if len(docs) > cache.max_documents:
+                    # Too many documents: the others are read as needed.
+                    break
+
+            else:
+                cache.set(key, docs)
+                cursor = None
+
+        for doc in docs or ():
+            obj = cls._hydrate(doc, trusted, fields)
+            yield obj if session is None else session.add(obj)
+
+        if cursor is not None:
+            async for doc in cursor:
+                obj = cls._hydrate(doc, trusted, fields)
+                yield obj if session is None else session.add(obj)
+
+    @classmethod
+    def query(cls, db, **options):
+        """ Return a lazy Query of the documents, options are passed to
+            find (e.g. trusted=True).
+        """
+        return Query(cls, db, **options)
+
+    @classmethod
+    def paginate(cls, db, criterion, page_size, token=None, keys=None,
+                 **kwargs):
+        """ Return a page of page_size documents matching criterion, sorted
+            by keys (fields or (field, direction) tuples, _id when None),
+            and the token of the next page, None after the last one.
+
+            Pass the token to get the next page: each page starts after the
+            keys of the last document of the previous one, so every page
+            costs the same however deep it is. keys are followed by _id
+            to order documents with the same keys, they must be indexed and
+            present in every document. kwargs are passed to find.
+        """
+
+        keys = get_sort_keys(keys)
+        if kwargs.get('fields') is not None:
+            # The next token needs the keys of the last document.
+            kwargs['fields'] = list(kwargs['fields']) + \
+                               [name.split('.')[0] for name, direction in keys]
+
+        if token is not None:
+            range_ = get_range(keys, decode_token(token, keys))
+            criterion = {'$and': [criterion, range_]} if criterion else range_
+
+        docs = list(cls.find(db, criterion, sort=keys, limit=page_size + 1,
+                             **kwargs))
+        if len(docs) <= page_size:
+            return docs, None
+
+        docs = docs[:page_size]
+        return docs, encode_token(keys, get_values(docs[-1], keys))
+
+    @classmethod
+    def prefetch(cls, db, docs, fields=None, session=None, cache=None):
+        """ Load the documents referenced by docs with one $in query by
+            referenced class, return docs. fields limits the references
+            loaded (e.g. [Member.groups]), all of them when it is None.
+
+            Documents already loaded are not loaded again, neither are the
+            ones in session (a Session): the loaded ones are added to it.
+            When a QueryCache is given, queries are cached by it.
+            References to missing documents stay unresolved: they raise
+            NoResultFound on access.
+        """
+
+        names = None
+        if fields is not None:
+            names = {field if isinstance(field, str) else field.field
+                     for field in fields}
+
+        pending = []
+        ids = collections.defaultdict(dict)  # _ids by class, in order.
+        for obj in docs:
+            refs = obj._refs or {}
+            for attribute in obj.__layout__:
+                if type(attribute) is not ReferenceAttribute or \
+                   attribute.name in refs or \
+                   (names is not None and attribute.name not in names):
+                    continue
+
+                ids_ = attribute.get_ids(obj)
+                if not ids_ and not attribute.many:
+                    continue
+
+                pending.append((obj, attribute, ids_))
+                ids[attribute.class_].update(dict.fromkeys(ids_))
+
+        loaded = {}
+        for class_, class_ids in ids.items():
+            query = []
+            for id_ in class_ids:
+                obj = None if session is None else session.get(class_, id_)
+                if obj is None:
+                    query.append(id_)
+
+                else:
+                    loaded[class_, id_] = obj
+
+            if not query:
+                continue
+
+            for obj in class_.find(db, {'_id': {'$in': query}},
+                                   session=session, cache=cache):
+                loaded[class_, obj._id] = obj
+
+        for obj, attribute, ids_ in pending:
+            refs = [loaded.get((attribute.class_, id_)) for id_ in ids_]
+            if None in refs:
+                continue
+
+            attribute.set_resolved(obj,
+                                   tuple(refs) if attribute.many else refs[0])
+
+        return docs
+
+    @classmethod
+    def find_columns(cls, db, criterion, fields, **kwargs):
+        """ Return a dict of NumPy arrays, one for each of fields (e.g.
+            [Account.name]), holding the values of the documents matching
+            criterion: documents are neither built nor validated.
+
+            Arrays are typed after the fields: Integer and Boolean arrays
+            with missing values are masked, Float and DateTime ones hold
+            NaN and NaT. Require numpy.
+        """
+
+        require_numpy()
+        columns, projection = cls._get_columns(fields)
+        docs = list(cls.get_collection(db).find(criterion, projection,
+                                                **kwargs))
+        return cls._to_columns(columns, docs)
+
+    @classmethod
+    def iter_columns(cls, db, criterion, fields, chunk_size=10000, **kwargs):
+        """ Like find_columns, but yield a dict of arrays every chunk_size
+            documents to bound the memory used.
+        """
+
+        require_numpy()
+        columns, projection = cls._get_columns(fields)
+        cursor = cls.get_collection(db).find(criterion, projection, **kwargs)
+        cursor.batch_size(chunk_size)
+        for docs in iter_batches(cursor, chunk_size):
+            yield cls._to_columns(columns, docs)
 
     @classmethod
-    def find(cls, db, criterion, **kwargs):
-        for doc in db[cls._COLLECTION].find(criterion, **kwargs):
-            yield cls.deserialize(**doc)
+    def _get_columns(cls, fields):
+        """ Return the fields of the columns by name and the projection.
+        """
+
+        columns = {}
+        for field in fields:
+            name = field if isinstance(field, str) else field.field
+            for class_ in [cls] + cls.__all_subclasses__():
+                if name in class_.__fields__:
+                    columns[name] = class_.__fields__[name]
+                    break
+
+            else:
+                msg = '{} is not a field of {}: embedded documents and ' \
+                      'lists cannot be columns.'
+                raise DocumentAttributeError(msg.format(name, cls.__name__))
+
+        projection = {name: 1 for name in columns}
+        if '_id' not in columns:
+            projection['_id'] = 0
+
+        return columns, projection
+
+    @classmethod
+    def _to_columns(cls, columns, docs):
+        return {name: to_array(field, [doc.get(name) for doc in docs])
+                for name, field in columns.items()}
+
+    @classmethod
+    def export(cls, db, criterion, file, format='jsonl', batch_size=1000,
+               **kwargs):
+        """ Write the serialized documents matching criterion to file, open
+            in binary mode, as JSON Lines (format='jsonl') or concatenated
+            BSON (format='bson'), reading batch_size documents at a time.
+            Return how many documents were written.
+        """
+
+        encode = get_encoder(format)
+        cursor = cls.get_collection(db).find(criterion, **kwargs)
+        cursor.batch_size(batch_size)
+
+        written = 0
+        for batch in iter_batches(cursor, batch_size):
+            file.write(b''.join(
+                encode(cls._export_values(cls.load(doc)._serialize()))
+                for doc in batch))
+            written += len(batch)
+
+        return written
+
+    @classmethod
+    def import_(cls, db, file, format='jsonl', batch_size=1000,
+                trusted=False, executor=None, max_pending=4, ordered=True):
+        """ Save the documents read from file, written by export, with a
+            bulk write every batch_size documents: documents replace the
+            stored ones which have the same _id. Return how many documents
+            were saved.
+
+            Documents are validated unless trusted is True: when executor
+            is given, batches are validated by its workers.
+        """
+
+        records = map(cls._import_values, iter_records(file, format))
+        batches = hydrate_batches(cls, iter_batches(records, batch_size),
+                                  trusted, None, executor, max_pending)
+        written = 0
+        try:
+            for batch in batches:
+                written += cls.save_many(db, batch, batch_size, ordered)
+
+        except BulkWriteError as e:
+            e.written += written
+            raise
+
+        finally:
+            batches.close()
+
+        return written
+
+    @classmethod
+    def _export_values(cls, values):
+        """ Return values, a serialized document of cls or of a subclass,
+            converted by the export method of their fields: e.g. dates
+            become datetimes, which BSON can encode.
+        """
+        return cls._convert_values(values, 'export')
+
+    @classmethod
+    def _import_values(cls, values):
+        """ Return values written by _export_values converted back by the
+            import_ method of their fields.
+        """
+        return cls._convert_values(values, 'import_')
+
+    @classmethod
+    def _convert_values(cls, values, method):
+
+        if not isinstance(values, dict):
+            # Left to the validation.
+            return values
+
+        discriminator = getattr(cls, cls._DISCRIMINATOR, None)
+        identity = values.get(discriminator) if discriminator else None
+        class_ = cls.__registry__.get(identity, cls) if identity else cls
+        # Untagged documents may belong to any subclass.
+        fields = {}
+        for candidate in reversed([class_] + class_.__all_subclasses__()):
+            fields.update(candidate.__attrs__)
+
+        result = {}
+        for name, value in values.items():
+            field = fields.get(name)
+            if field is not None and value is not None:
+                value = getattr(field, method)(value)
+
+            result[name] = value
+
+        return result
+
+    @classmethod
+    def _get_projection(cls, fields):
+        """ Return the names of fields and the pymongo projection.
+        """
+
+        names = set()
+        for field in fields:
+            name = field if isinstance(field, str) else field.field
+            classes = [cls] + cls.__all_subclasses__()
+            if not any(name in class_.__attrs__ for class_ in classes):
+                msg = '{} is not a field of {}.'
+                raise DocumentAttributeError(msg.format(name, cls.__name__))
+
+            names.add(name)
+
+        projection = {name: 1 for name in names}
+        discriminator = getattr(cls, cls._DISCRIMINATOR, None)
+        if discriminator is not None:
+            projection[discriminator] = 1
+
+        return names, projection
+
+    @classmethod
+    def _get_windows(cls, windows):
+        """ Return the $slice of the embedded lists by name.
+        """
+
+        if isinstance(windows, dict):
+            windows = windows.items()
+
+        result = {}
+        for field, window in windows:
+            name = field if isinstance(field, str) else field.field
+            classes = [cls] + cls.__all_subclasses__()
+            if not any(name in class_.__embedded_lists__
+                       for class_ in classes):
+                msg = '{} is not an embedded list of {}.'
+                raise DocumentAttributeError(msg.format(name, cls.__name__))
+
+            result[name] = get_slice(window)
+
+        return result
+
+    @classmethod
+    def _hydrate(cls, doc, trusted, fields):
+
+        if trusted is None:
+            trusted = cls.__trusted__
+
+        if fields is not None:
+            obj = cls.load(doc, fields)
+            return obj if trusted else obj.validate()
+
+        if trusted:
+            return cls.load(doc)
+
+        obj = cls.deserialize(**doc)
+        obj._reset_changes()
+        return obj
 
     def serialize(self):
         """ Convert document to dict.
+
+            The result is cached until a field of the document or of its
+            embedded documents is set: the returned dict is a copy of the
+            cache, embedded dicts and lists included, which the caller can
+            modify. Writes use the cache itself.
+        """
+
+        return copy_serialized(self._serialize())
+
+    def _serialize(self):
+        """ Return the cached serialization, rebuilding it when needed:
+            unchanged embedded documents give back their cached dicts.
         """
-        values = {name: getattr(self, name)
-                  for name in self.__fields__
-                  if getattr(self, name, colander.null) != colander.null}
-        values.update({name: getattr(self, name).serialize()
-                       for name in self.__embedded_docs__
-                       if getattr(self, name, colander.null) != colander.null})
-        values.update({name: [obj.serialize()
-                              for obj in getattr(self, name)]
-                       for name in self.__embedded_lists__
-                       if getattr(self, name, colander.null) != colander.null})
+
+        values = self._serialized
+        if values is not None and self._is_serialized(values):
+            return values
+
+        hooks = instrumentation
+        start = time.perf_counter() if hooks is not None else 0.0
+        values = {}
+
+        # Read the stored values: embedded documents and lists not loaded
+        # yet are passed through as they came from the database.
+        for attribute in self.__layout__:
+            value = attribute.get_raw(self)
+
+            if value is not colander.null and value is not unloaded:
+                values[attribute.name] = serialize_value(value)
+
+        discriminator = getattr(self, self._DISCRIMINATOR, None)
+        if discriminator is not None:
+            values[discriminator] = getattr(self, self._IDENTITY)
+
+        object.__setattr__(self, '_serialized', values)
+        if hooks is not None:
+            hooks.serialize(self.__class__, time.perf_counter() - start)
+
         return values
 
+    def _is_serialized(self, values):
+        """ Return True if the embedded documents of the cached values are
+            serialized as they were: an embedded document rebuilds its
+            serialization when it changes.
+        """
+
+        for attribute in self.__layout__:
+
+            if type(attribute) is not EmbeddedAttribute:
+                continue
+
+            value = attribute.get_raw(self)
+            if isinstance(value, Document):
+                if value._serialize() is not values.get(attribute.name):
+                    return False
+
+            elif isinstance(value, DocumentList):
+                if value.serialize() is not values.get(attribute.name):
+                    return False
+
+        return True
+
+    @classmethod
+    def insert_many(cls, db, docs, batch_size=1000, ordered=True):
+        """ Insert docs sending a bulk write every batch_size documents.
+
+            Inserted documents get their _id, return how many they are.
+            Raise BulkWriteError when some documents are not inserted: with
+            ordered writes no document is sent after the first error, the
+            documents not sent are its unprocessed list.
+        """
+        return cls._write_many(db, docs, insert_request, batch_size, ordered)
+
+    @classmethod
+    def save_many(cls, db, docs, batch_size=1000, ordered=True):
+        """ Like insert_many, but documents which already have an _id
+            replace the stored ones (or are inserted if they do not exist).
+        """
+        return cls._write_many(db, docs, save_request, batch_size, ordered)
+
+    @classmethod
+    async def ainsert_many(cls, db, docs, batch_size=1000, ordered=True):
+        return await cls._awrite_many(db, docs, insert_request,
+                                      batch_size, ordered)
+
+    @classmethod
+    async def asave_many(cls, db, docs, batch_size=1000, ordered=True):
+        return await cls._awrite_many(db, docs, save_request,
+                                      batch_size, ordered)
+
+    @classmethod
+    def _write_many(cls, db, docs, request, batch_size, ordered):
+
+        collection = cls.get_collection(db)
+        written = 0
+        errors = []
+        unprocessed = []
+
+        batches = iter_batches(docs, batch_size)
+        for batch in batches:
+            ids, requests = cls._get_bulk_requests(batch, request)
+
+            try:
+                call_collection(cls, collection, 'bulk_write', requests,
+                                ordered=ordered)
+
+            except pymongo.errors.BulkWriteError as e:
+                failed = get_write_errors(e)
+
+            else:
+                failed = {}
+
+            invalidate_queries(collection)
+            written += cls._set_bulk_results(batch, ids, failed, ordered,
+                                             errors, unprocessed)
+            if ordered and failed:
+                unprocessed.extend(doc for batch in batches for doc in batch)
+                break
+
+        return cls._get_bulk_written(written, errors, unprocessed)
+
+    @classmethod
+    async def _awrite_many(cls, db, docs, request, batch_size, ordered):
+
+        collection = cls.get_collection(db)
+        written = 0
+        errors = []
+        unprocessed = []
+
+        batches = iter_batches(docs, batch_size)
+        for batch in batches:
+            ids, requests = cls._get_bulk_requests(batch, request)
+
+            try:
+                await acall_collection(cls, collection, 'bulk_write',
+                                       requests, ordered=ordered)
+
+            except pymongo.errors.BulkWriteError as e:
+                failed = get_write_errors(e)
+
+            else:
+                failed = {}
+
+            invalidate_queries(collection)
+            written += cls._set_bulk_results(batch, ids, failed, ordered,
+                                             errors, unprocessed)
+            if ordered and failed:
+                unprocessed.extend(doc for batch in batches for doc in batch)
+                break
+
+        return cls._get_bulk_written(written, errors, unprocessed)
+
+    @classmethod
+    def _get_bulk_requests(cls, batch, request):
+        """ Return the _ids and the bulk write requests of batch.
+        """
+
+        ids = []
+        requests = []
+        for doc in batch:
+            if not isinstance(doc, cls):
+                msg = 'Object {} must be an instance of {}.'
+                raise DocumentTypeError(msg.format(doc, cls.__name__))
+
+            if doc.is_partial():
+                msg = 'Cannot write {}: some fields are not loaded.'
+                raise DocumentTypeError(msg.format(doc))
+
+            if doc._is_pending():
+                doc.validate()
+
+            values = dict(doc._serialize())
+            new = values.get('_id') is None
+            if new:
+                # Generate the _id here to set it after the write.
+                values['_id'] = bson.objectid.ObjectId()
+
+            ids.append(values['_id'])
+            requests.append(request(values, new))
+
+        return ids, requests
+
+    @classmethod
+    def _set_bulk_results(cls, batch, ids, failed, ordered, errors,
+                          unprocessed):
+        """ Set the _id of the written documents of batch, add the failed
+            ones to errors and the ones not sent to unprocessed, return how
+            many documents were written.
+        """
+
+        written = 0
+        for index, doc in enumerate(batch):
+
+            if index in failed:
+                errors.append((doc, failed[index]))
+                continue
+
+            if ordered and failed and index > min(failed):
+                # Ordered bulk writes stop at the first error.
+                unprocessed.append(doc)
+                continue
+
+            doc._id = ids[index]
+            doc._reset_changes()
+            written += 1
+
+        return written
+
+    @classmethod
+    def _get_bulk_written(cls, written, errors, unprocessed):
+
+        if errors:
+            msg = '{} documents of {} not written.'
+            msg = msg.format(len(errors) + len(unprocessed), cls.__name__)
+            raise BulkWriteError(msg, errors, written, unprocessed)
+
+        return written
+
+    def get_changes(self):
+        """ Return the update operators ($set, $unset and $push) which
+            apply to the stored document the changes made since the
+            document was loaded or saved.
+        """
+        changes = {'$set': {}, '$unset': {}, '$push': {}}
+        self._collect_changes('', changes)
+        return {operator: values
+                for operator, values in changes.items()
+                if values}
+
+    def _collect_changes(self, prefix, changes):
+
+        for attribute in self.__layout__:
+            path = prefix + attribute.name
+            value = attribute.get_raw(self)
+
+            if attribute.name in self._dirty:
+                if value is None or value is colander.null:
+                    changes['$unset'][path] = ''
+
+                else:
+                    changes['$set'][path] = serialize_value(value)
+
+            elif isinstance(value, Document):
+                if value._dirty is None:
+                    changes['$set'][path] = value._serialize()
+
+                else:
+                    value._collect_changes(path + '.', changes)
+
+            elif isinstance(value, DocumentList):
+                value.collect_changes(path, changes)
+
+    def _reset_changes(self):
+        """ Start tracking changes from the current values.
+        """
+        object.__setattr__(self, '_dirty', clean)
+
+        for attribute in self.__layout__:
+            value = attribute.get_raw(self)
+
+            if isinstance(value, Document):
+                value._reset_changes()
+
+            elif isinstance(value, DocumentList):
+                value.reset_changes()
+
     def save(self, db, **kwargs):
-        id_ = db[cls._COLLECTION].save(self.serialize(), **kwargs)
-        if not id_ is None:
-            self._id = id_
+        """ Insert the document if it has no _id, otherwise update it: the
+            whole document replaces the stored one, or is inserted, when
+            changes are not tracked or when the stored one was removed.
+        """
 
-        return id_
+        if self._id is None:
+            return self.insert(db, **kwargs)
+
+        tracked = self._dirty is not None
+        result = self.update(db, upsert=not tracked, **kwargs)
+        if tracked and self._set_removed(result):
+            self.update(db, upsert=True, **kwargs)
 
-    def insert(self, db, **kwargs):
-        self._id = db[cls._COLLECTION].insert(self.serialize(), **kwargs)
         return self._id
 
+    def insert(self, db, **kwargs):
+        collection = self.get_collection(db)
+        result = call_collection(self.__class__, collection, 'insert_one',
+                                 self._get_insert(), **kwargs)
+        invalidate_queries(collection)
+        return self._set_inserted(result)
+
     def update(self, db, **kwargs):
-        return db[cls._COLLECTION].update(self.serialize(), **kwargs)
+        """ Send the changes made since the document was loaded or saved,
+            the whole document replaces the stored one when changes are
+            not tracked. Return the pymongo result, None without changes.
+        """
+
+        request = self._get_update()
+        if request is None:
+            return None
+
+        method, args = request
+        collection = self.get_collection(db)
+        result = call_collection(self.__class__, collection, method,
+                                 *args, **kwargs)
+        invalidate_queries(collection)
+        self._reset_changes()
+        return result
 
     def remove(self, db, **kwargs):
-        return db[cls._COLLECTION].remove(self.serialize(), **kwargs)
+        collection = self.get_collection(db)
+        result = call_collection(self.__class__, collection, 'delete_one',
+                                 {'_id': self._id}, **kwargs)
+        invalidate_queries(collection)
+        evict_document(self)
+        return result
+
+    async def asave(self, db, **kwargs):
+
+        if self._id is None:
+            return await self.ainsert(db, **kwargs)
+
+        tracked = self._dirty is not None
+        result = await self.aupdate(db, upsert=not tracked, **kwargs)
+        if tracked and self._set_removed(result):
+            await self.aupdate(db, upsert=True, **kwargs)
+
+        return self._id
+
+    async def ainsert(self, db, **kwargs):
+        collection = self.get_collection(db)
+        result = await acall_collection(self.__class__, collection,
+                                        'insert_one', self._get_insert(),
+                                        **kwargs)
+        invalidate_queries(collection)
+        return self._set_inserted(result)
+
+    async def aupdate(self, db, **kwargs):
+
+        request = self._get_update()
+        if request is None:
+            return None
+
+        method, args = request
+        collection = self.get_collection(db)
+        result = await acall_collection(self.__class__, collection, method,
+                                        *args, **kwargs)
+        invalidate_queries(collection)
+        self._reset_changes()
+        return result
+
+    async def aremove(self, db, **kwargs):
+        collection = self.get_collection(db)
+        result = await acall_collection(self.__class__, collection,
+                                        'delete_one', {'_id': self._id},
+                                        **kwargs)
+        invalidate_queries(collection)
+        evict_document(self)
+        return result
+
+    def _get_insert(self):
+        """ Return the values sent by insert.
+        """
+
+        if self.is_partial():
+            msg = 'Cannot insert {}: some fields are not loaded.'
+            raise DocumentTypeError(msg.format(self.__class__.__name__))
+
+        if self._is_pending():
+            self.validate()
+
+        values = dict(self._serialize())
+        if values.get('_id') is None:
+            values.pop('_id', None)
+
+        return values
+
+    def _set_inserted(self, result):
+        self._id = result.inserted_id
+        self._reset_changes()
+        return self._id
+
+    def _set_removed(self, result):
+        """ Return True if the update of result found no stored document:
+            changes are no longer tracked, the next update replaces it.
+        """
+
+        if result is None or result.matched_count:
+            return False
+
+        # Upserting the changes would store a fragment of the document.
+        if self.is_partial():
+            msg = 'Cannot save {}: it was removed and some fields are not ' \
+                  'loaded.'
+            raise DocumentTypeError(msg.format(self.__class__.__name__))
+
+        object.__setattr__(self, '_dirty', None)
+        return True
+
+    def _get_update(self):
+        """ Return the collection method and the arguments used by update,
+            None if there is nothing to update.
+        """
+
+        if self._is_pending():
+            self.validate()
+
+        if self._id is None:
+            msg = 'Cannot update {}: it has no _id.'
+            raise DocumentTypeError(msg.format(self.__class__.__name__))
+
+        if self._dirty is None:
+            return 'replace_one', ({'_id': self._id}, self._serialize())
+
+        changes = self.get_changes()
+        if not changes:
+            return None
+
+        return 'update_one', ({'_id': self._id}, changes)
+
+
+def insert_request(values, new):
+    return pymongo.InsertOne(values)
+
+
+def save_request(values, new):
+
+    if new:
+        return pymongo.InsertOne(values)
+
+    return pymongo.ReplaceOne({'_id': values['_id']}, values, upsert=True)
+
+
+def iter_batches(iterable, size):
+    """ Yield lists of size items taken from iterable.
+    """
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+
+        yield batch
+
+
+def get_write_errors(error):
+    """ Return the messages of a pymongo BulkWriteError by request index.
+    """
+    return {item['index']: item['errmsg']
+            for item in error.details['writeErrors']}
+
+
+def get_slice(window):
+    """ Return the $slice of window: n, -n or (skip, limit).
+    """
+
+    if isinstance(window, int):
+        return window
+
+    try:
+        skip, limit = window
+
+    except (TypeError, ValueError):
+        skip = limit = None
+
+    if not isinstance(skip, int) or not isinstance(limit, int) or limit <= 0:
+        raise ValueError('Invalid window: {}'.format(window))
+
+    return [skip, limit]
+
+
+def add_windows(windows, fields, kwargs):
+    """ Add the $slice of windows to the projection in kwargs, return the
+        loaded fields.
+    """
+
+    projection = dict(kwargs.get('projection') or {})
+    projection.update((name, {'$slice': window})
+                      for name, window in windows.items())
+    kwargs['projection'] = projection
+    return None if fields is None else fields | set(windows)
+
+
+def set_windows(obj, windows):
+    """ Mark the embedded lists of obj loaded by windows as partial.
+    """
+
+    for name, window in windows.items():
+        value = getattr(obj, name, None)
+        if isinstance(value, DocumentList):
+            value.set_window(window)
+
+    return obj
+
+
+def has_references(cls):
+    """ Return True if documents of cls or of its subclasses have
+        references.
+    """
+    return any(type(attribute) is ReferenceAttribute
+               for class_ in [cls] + cls.__all_subclasses__()
+               for attribute in class_.__layout__)
+
+
+def iter_referencing(db, docs):
+    """ Yield docs, which load their references from db on access.
+    """
+
+    for obj in docs:
+        object.__setattr__(obj, '_db', db)
+        yield obj
+
+
+def iter_prefetched(db, docs, fields, batch_size, session, cache):
+    """ Yield docs, loading the references of batch_size documents at once.
+    """
+
+    for batch in iter_batches(docs, batch_size):
+        for obj in batch:
+            object.__setattr__(obj, '_db', db)
+
+        Document.prefetch(db, batch, fields, session, cache)
+        for obj in batch:
+            yield obj
+
+
+def hydrate_batch(cls, docs, trusted, fields):
+    """ Hydrate docs as cls instances, run by the workers of Document.find.
+    """
+    return [cls._hydrate(doc, trusted, fields) for doc in docs]
+
+
+def hydrate_batches(cls, batches, trusted, fields, executor, max_pending):
+    """ Yield the lists of documents hydrated from batches, in order.
+
+        When executor is given, batches are hydrated by its workers: at
+        most max_pending batches are waiting.
+    """
+
+    if executor is None:
+        for batch in batches:
+            yield hydrate_batch(cls, batch, trusted, fields)
+
+        return
+
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < max_pending:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+
+                pending.append(executor.submit(hydrate_batch, cls, batch,
+                                               trusted, fields))
+
+            if not pending:
+                return
+
+            yield pending.popleft().result()
+
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_encoder(format):
+    """ Return the function which encodes a serialized document in format.
+    """
+
+    if format == 'jsonl':
+        return lambda values: dumps_json(values).encode('utf-8') + b'\n'
+
+    if format == 'bson':
+        return bson.encode
+
+    raise ValueError('Unknown format: {}'.format(format))
+
+
+def iter_records(file, format):
+    """ Yield the serialized documents read from file in format.
+    """
+
+    if format == 'jsonl':
+        for line in file:
+            line = line.strip()
+            if line:
+                yield loads_json(line.decode('utf-8'))
+
+    elif format == 'bson':
+        for values in bson.decode_file_iter(file):
+            yield values
+
+    else:
+        raise ValueError('Unknown format: {}'.format(format))
+
+
+def serialize_value(value):
+    """ Convert a stored value to the one written in the database: the
+        values of embedded documents and lists are their cached ones, which
+        must not be modified.
+    """
+
+    if isinstance(value, Document):
+        return value._serialize()
+
+    if isinstance(value, DocumentList):
+        return value.serialize()
+
+    return value
+
+
+def copy_serialized(values):
+    """ Return a copy of values, a serialized document: dicts and lists are
+        copied at any depth, the other values are shared.
+    """
+
+    result = values.copy()
+    for key, value in values.items():
+        if type(value) is dict:
+            result[key] = copy_serialized(value)
+
+        elif type(value) is list:
+            result[key] = copy_serialized_list(value)
+
+    return result
+
+
+def copy_serialized_list(values):
+
+    return [copy_serialized(item) if type(item) is dict else
+            copy_serialized_list(item) if type(item) is list else item
+            for item in values]
 
 
 class DocumentList(list):
+    """ List of embedded documents, it tracks the changes made after the
+        document which contains it was loaded or saved: documents appended
+        at the end are pushed, any other change rewrites the list.
+    """
+
+    __slots__ = ('class_', 'pushed', 'rewritten', 'serialized', 'window',
+                 'offset')
 
     def __init__(self, class_, list_):
         self.class_ = class_
+        self.pushed = 0
+        self.rewritten = False
+        self.serialized = None
+        self.window = None  # $slice of the loaded items, None if all are.
+        self.offset = 0  # index of the first item, None if it is unknown.
         list.__init__(self, [self.validate_document(doc)
                              for doc in list_])
 
     def append(self, obj):
         list.append(self, self.validate_document(obj))
+        self.pushed += 1
+        self.serialized = None
 
     def extend(self, list_):
-        list.extend(self, [self.validate_document(doc)
-                           for doc in list_])
+        list_ = [self.validate_document(doc) for doc in list_]
+        list.extend(self, list_)
+        self.pushed += len(list_)
+        self.serialized = None
+
+    def __iadd__(self, list_):
+        self.extend(list_)
+        return self
 
     def insert(self, i, obj):
+        self.check_rewrite()
         list.insert(self, i, self.validate_document(obj))
+        self.rewritten = True
+        self.serialized = None
+
+    def __setitem__(self, i, obj):
+        self.check_rewrite()
+        if isinstance(i, slice):
+            obj = [self.validate_document(doc) for doc in obj]
+
+        else:
+            obj = self.validate_document(obj)
+
+        list.__setitem__(self, i, obj)
+        self.rewritten = True
+        self.serialized = None
+
+    def __delitem__(self, i):
+        self.check_rewrite()
+        list.__delitem__(self, i)
+        self.rewritten = True
+        self.serialized = None
+
+    def pop(self, *args):
+        self.check_rewrite()
+        self.rewritten = True
+        self.serialized = None
+        return list.pop(self, *args)
+
+    def remove(self, obj):
+        self.check_rewrite()
+        list.remove(self, obj)
+        self.rewritten = True
+        self.serialized = None
+
+    def clear(self):
+        self.check_rewrite()
+        list.clear(self)
+        self.rewritten = True
+        self.serialized = None
+
+    def sort(self, *args, **kwargs):
+        self.check_rewrite()
+        list.sort(self, *args, **kwargs)
+        self.rewritten = True
+        self.serialized = None
+
+    def reverse(self):
+        self.check_rewrite()
+        list.reverse(self)
+        self.rewritten = True
+        self.serialized = None
+
+    def check_rewrite(self):
+
+        if self.window is not None:
+            msg = 'Cannot rewrite a window of a list of {}: items can ' \
+                  'only be appended.'
+            raise DocumentTypeError(msg.format(self.class_.__name__))
+
+    def set_window(self, window):
+        """ Mark the list as holding the items selected by window, a $slice.
+        """
+
+        self.window = window
+        if isinstance(window, int):
+            # The first or the last items.
+            self.offset = 0 if window >= 0 else None
+
+        else:
+            self.offset = window[0] if window[0] >= 0 else None
+
+    def __reduce__(self):
+        # Items must not be appended before class_ is restored.
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['serialized'] = None
+        return (self.__class__, (self.class_, list(self)), (None, state))
+
+    def serialize(self):
+        """ Return the cached list of the serialized documents, rebuilt
+            when the list or one of its documents changes.
+        """
+
+        values = self.serialized
+        if values is not None and len(values) == len(self) and \
+           all(obj._serialize() is value for obj, value in zip(self, values)):
+            return values
+
+        self.serialized = [obj._serialize() for obj in self]
+        return self.serialized
 
     def validate_document(self, doc):
 
@@ -384,4 +2879,50 @@ class DocumentList(list):
             msg = 'Object {} must be an instance of {}.'
             raise DocumentTypeError(msg.format(doc, self.class_.__name__))
 
-        return doc
\ No newline at end of file
+        return doc
+
+    def collect_changes(self, path, changes):
+        """ Add to changes the update operators of the list.
+        """
+
+        stored = len(self) - self.pushed
+        nested = {'$set': {}, '$unset': {}, '$push': {}}
+        offset = self.offset or 0
+
+        if not self.rewritten:
+            for index, obj in enumerate(self[:stored]):
+                if obj._dirty is None:
+                    self.rewritten = True
+                    break
+
+                obj._collect_changes('{}.{}.'.format(path, offset + index),
+                                     nested)
+
+        if self.window is not None and \
+           (self.rewritten or (self.pushed and any(nested.values()))):
+            msg = 'Cannot update {}: only a window of it is loaded, save ' \
+                  'the changes of its items before appending.'
+            raise DocumentTypeError(msg.format(path))
+
+        if self.offset is None and any(nested.values()):
+            msg = 'Cannot update the items of {}: their position is ' \
+                  'unknown, load a window starting from the beginning.'
+            raise DocumentTypeError(msg.format(path))
+
+        if self.rewritten or (self.pushed and any(nested.values())):
+            # MongoDB cannot push and set the items of an array at once.
+            changes['$set'][path] = serialize_value(self)
+            return
+
+        if self.pushed:
+            changes['$push'][path] = {'$each': [obj._serialize()
+                                                for obj in self[stored:]]}
+
+        for operator in nested:
+            changes[operator].update(nested[operator])
+
+    def reset_changes(self):
+        self.pushed = 0
+        self.rewritten = False
+        for obj in self:
+            obj._reset_changes()
@@ -22,7 +22,44 @@ class DocumentAttributeError(AttributeError):
     """
 
 
+class FieldNotLoaded(DocumentAttributeError):
+    """ This exception must be raised when a field which was excluded by the
+        projection of a query is accessed.
+    """
+
+
 class DocumentTypeError(TypeError):
     """ This exception must be raised when document's __setattr__ and __init__
         receive a value which has wrong type.
     """
+
+
+class ValidationError(DocumentTypeError):
+    """ This exception must be raised when Document.validate finds invalid
+        values: errors maps the paths of the fields (e.g. 'head.meta.0.value'
+        or None for the whole document) to the messages.
+    """
+
+    def __init__(self, msg, errors):
+        DocumentTypeError.__init__(self, msg)
+        self.errors = errors
+
+
+class BulkWriteError(Exception):
+    """ This exception must be raised when some documents of a bulk write
+        are not written: errors is a list of (document, message) tuples,
+        unprocessed the list of the documents which were not sent because
+        an ordered write stopped at the first error.
+    """
+
+    def __init__(self, msg, errors, written, unprocessed=()):
+        Exception.__init__(self, msg)
+        self.errors = errors
+        self.written = written
+        self.unprocessed = list(unprocessed)
+
+
+class UnindexedQueryWarning(UserWarning):
+    """ This warning is issued by the queries of classes whose __explain__
+        is True when the query plan scans the whole collection.
+    """
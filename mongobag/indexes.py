@@ -0,0 +1,142 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+from .exc import UnindexedQueryWarning
+import logging
+import mongoq
+import pymongo
+import warnings
+
+__all__ = ['Index']
+
+log = logging.getLogger(__file__)
+
+
+explained = set()  # shapes of the queries already explained, by collection.
+
+
+class Index(object):
+    """ Index of the documents of a class, declared in its __indexes__:
+
+        __indexes__ = [Index(Q.url, unique=True),
+                       Index('language.code', (Q.title, pymongo.DESCENDING))]
+
+        keys are fields (names or mongoq fields, like Url.url) or (field,
+        direction) tuples, options are passed to pymongo create_index.
+        A key or a list of keys can be used in place of an Index.
+    """
+
+    def __init__(self, *keys, **options):
+
+        if not keys:
+            raise ValueError('Indexes need at least one key.')
+
+        self.keys = [get_key(key) for key in keys]
+        self.options = options
+
+    def __repr__(self):
+        return 'Index({}, {})'.format(self.keys, self.options)
+
+    def __eq__(self, other):
+        return isinstance(other, Index) and \
+               (self.keys, self.options) == (other.keys, other.options)
+
+    def __hash__(self):
+        return hash(tuple(self.keys))
+
+
+def get_key(key):
+    """ Return the (name, direction) tuple of an index key.
+    """
+
+    direction = pymongo.ASCENDING
+    if isinstance(key, tuple):
+        key, direction = key
+
+    if isinstance(key, mongoq.Query):
+        key = key.field
+
+    if not isinstance(key, str) or not key:
+        raise ValueError('{} is not a field.'.format(key))
+
+    return key, direction
+
+
+def get_index(spec):
+    """ Return spec, an Index or one or more keys, as an Index.
+    """
+
+    if isinstance(spec, Index):
+        return spec
+
+    if isinstance(spec, list):
+        return Index(*spec)
+
+    return Index(spec)
+
+
+def get_shape(value):
+    """ Return the shape of a criterion: its fields and operators, without
+        the values they are compared with.
+    """
+
+    if isinstance(value, dict):
+        return tuple(sorted((key, get_shape(item))
+                            for key, item in value.items()))
+
+    if isinstance(value, (list, tuple)):
+        return frozenset(get_shape(item) for item in value)
+
+    return None
+
+
+def is_collection_scan(plan):
+    """ Return True if a stage of plan, part of an explain output, is a
+        collection scan.
+    """
+
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+
+        return any(is_collection_scan(value) for value in plan.values())
+
+    if isinstance(plan, list):
+        return any(is_collection_scan(value) for value in plan)
+
+    return False
+
+
+def clear_explained():
+    """ Explain the queries again, called when indexes are created.
+    """
+    explained.clear()
+
+
+def explain(class_, collection, criterion, *args, **kwargs):
+    """ Warn with UnindexedQueryWarning when criterion does a collection
+        scan: each shape of query is explained once.
+    """
+
+    if not isinstance(criterion, dict) or not criterion:
+        # find_one by _id or queries of the whole collection.
+        return
+
+    shape = (collection.full_name, get_shape(criterion),
+             repr(kwargs.get('sort')))
+    if shape in explained:
+        return
+
+    explained.add(shape)
+    plan = collection.find(criterion, *args, **kwargs).explain()
+    if not is_collection_scan(plan.get('queryPlanner', {})
+                                  .get('winningPlan', plan)):
+        return
+
+    msg = 'Query {} of {} scans the whole {} collection: no index ' \
+          'matches it.'.format(dict(criterion), class_.__name__,
+                               collection.name)
+    warnings.warn(msg, UnindexedQueryWarning, stacklevel=3)
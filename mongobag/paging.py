@@ -0,0 +1,105 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+""" Keyset pagination: pages start after the sort keys of the last document
+of the previous page, so the server seeks them in the index instead of
+skipping the documents of the previous pages.
+"""
+
+from .indexes import get_key
+import base64
+import binascii
+import bson
+import logging
+import mongoq
+import pymongo
+
+__all__ = []
+
+log = logging.getLogger(__file__)
+
+
+def get_sort_keys(keys):
+    """ Return the (name, direction) sort keys of a page: _id ends them to
+        order documents with the same values.
+    """
+
+    keys = [get_key(key) for key in keys or []]
+    if not any(name == '_id' for name, direction in keys):
+        keys.append(('_id', pymongo.ASCENDING))
+
+    return keys
+
+
+def encode_token(keys, values):
+    """ Return the opaque continuation token of the page after values.
+    """
+
+    data = bson.encode({'k': [list(key) for key in keys], 'v': values})
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_token(token, keys):
+    """ Return the values encoded in token, raise ValueError if it is not
+        a token of a page sorted by keys.
+    """
+
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = bson.decode(data)
+
+    except (TypeError, ValueError, binascii.Error, bson.errors.BSONError):
+        raise ValueError('Invalid token: {}'.format(token))
+
+    if values.get('k') != [list(key) for key in keys] or \
+       len(values.get('v', [])) != len(keys):
+        msg = 'Invalid token: {} is not sorted by {}.'
+        raise ValueError(msg.format(token, keys))
+
+    return values['v']
+
+
+def get_range(keys, values):
+    """ Return the mongoq criterion of the documents sorted after values:
+        with compound keys, ($or) one of them comes after its value and
+        the previous ones are equal.
+    """
+
+    terms = []
+    for index, (name, direction) in enumerate(keys):
+        term = mongoq.Query()
+        for previous, value in zip(keys[:index], values):
+            term = term + (getattr(mongoq.Q, previous[0]) == value)
+
+        field = getattr(mongoq.Q, name)
+        if direction < 0:
+            term = term + (field < values[index])
+
+        else:
+            term = term + (field > values[index])
+
+        terms.append(term)
+
+    if len(terms) == 1:
+        return terms[0]
+
+    return mongoq.Query({'$or': terms})
+
+
+def get_values(obj, keys):
+    """ Return the values of the sort keys of obj, a document.
+    """
+
+    serialized = obj.serialize()
+    values = []
+    for name, direction in keys:
+        value = serialized
+        for part in name.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+
+        values.append(value)
+
+    return values
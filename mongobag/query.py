@@ -0,0 +1,174 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+from .exc import (MultipleResultsFound,
+                  NoResultFound)
+from .indexes import get_key
+import logging
+
+__all__ = ['Query']
+
+log = logging.getLogger(__file__)
+
+
+class Query(object):
+    """ Lazy query of the documents of class_ stored in db, returned by
+        Document.query: documents are loaded when the query is iterated.
+
+        Methods return a new query, so they can be chained:
+
+        Page.query(db).filter(Page.enabled == True).sort(Page.url).limit(10)
+
+        options are passed to Document.find (e.g. trusted, session, cache).
+    """
+
+    def __init__(self, class_, db, **options):
+        self.class_ = class_
+        self.db = db
+        self.options = options
+        self.criteria = []
+        self.keys = []
+        self.fields = None
+        self.skipped = 0
+        self.limited = 0
+
+    def _clone(self, **attrs):
+        query = object.__new__(self.__class__)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(attrs)
+        return query
+
+    def filter(self, *criteria, **values):
+        """ Return a query of the documents which also match criteria,
+            mongoq expressions (e.g. Page.url == '/') or dicts, and whose
+            fields have the given values.
+        """
+
+        criteria = list(criteria)
+        if values:
+            criteria.append(values)
+
+        return self._clone(criteria=self.criteria + criteria)
+
+    def sort(self, *keys):
+        """ Return a query sorted by keys: fields (e.g. Page.url) or
+            (field, direction) tuples, added to the previous ones.
+        """
+        return self._clone(keys=self.keys + [get_key(key) for key in keys])
+
+    def skip(self, skip):
+        return self._clone(skipped=skip)
+
+    def limit(self, limit):
+        """ Return a query of at most limit documents, 0 for no limit.
+        """
+        return self._clone(limited=limit)
+
+    def only(self, *fields):
+        """ Return a query which loads fields only: the others raise
+            FieldNotLoaded.
+        """
+        return self._clone(fields=list(fields))
+
+    def get_criterion(self):
+        """ Return the MongoDB criterion of the query.
+        """
+
+        criterion = {}
+        for other in self.criteria:
+            if set(criterion) & set(other):
+                # Fields constrained twice: all the criteria must match.
+                return {'$and': [dict(item) for item in self.criteria]}
+
+            criterion.update(other)
+
+        return criterion
+
+    def __iter__(self):
+
+        kwargs = dict(self.options)
+        if self.keys:
+            kwargs['sort'] = self.keys
+
+        if self.skipped:
+            kwargs['skip'] = self.skipped
+
+        if self.limited:
+            kwargs['limit'] = self.limited
+
+        return iter(self.class_.find(self.db, self.get_criterion(),
+                                     fields=self.fields, **kwargs))
+
+    def paginate(self, page_size, token=None):
+        """ Return a page of the query and the token of the next one, see
+            Document.paginate: the sort keys of the query are the keys of
+            the pages, skip and limit are ignored.
+        """
+        return self.class_.paginate(self.db, self.get_criterion(), page_size,
+                                    token, self.keys or None,
+                                    fields=self.fields, **self.options)
+
+    def _call(self, method, *args, **kwargs):
+        # The collection is called directly: a field of class_ may be
+        # named like the method (e.g. count = Integer()).
+        from .declarative import call_collection
+        if 'session' in self.options:
+            kwargs['session'] = self.options['session']
+
+        class_ = self.class_
+        return call_collection(class_, class_.get_collection(self.db), method,
+                               *args, **kwargs)
+
+    def count(self):
+        """ Return how many documents match the query, counted by the
+            server.
+        """
+
+        kwargs = {}
+        if self.skipped:
+            kwargs['skip'] = self.skipped
+
+        if self.limited:
+            kwargs['limit'] = self.limited
+
+        return self._call('count_documents', self.get_criterion(), **kwargs)
+
+    def exists(self):
+        """ Return True if some document matches the query.
+        """
+        return self.limit(1).count() > 0
+
+    def distinct(self, field):
+        """ Return the distinct values of field in the matching documents.
+        """
+        name = field if isinstance(field, str) else field.field
+        return self._call('distinct', name, self.get_criterion())
+
+    def first(self):
+        """ Return the first document, None if no document matches.
+        """
+
+        for obj in self.limit(1):
+            return obj
+
+        return None
+
+    def one(self):
+        """ Return the only matching document: raise NoResultFound if there
+            is none, MultipleResultsFound if there are more.
+        """
+
+        limit = 2 if not self.limited else min(self.limited, 2)
+        docs = list(self.limit(limit))
+        if not docs:
+            msg = 'No result for: {}'.format(self.get_criterion())
+            raise NoResultFound(msg)
+
+        if len(docs) > 1:
+            msg = 'Multiple results for: {}'.format(self.get_criterion())
+            raise MultipleResultsFound(msg)
+
+        return docs[0]
@@ -5,6 +5,7 @@
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
 from .types import ObjectId as objectid
+import bson
 import colander
 import datetime
 import logging
@@ -17,6 +18,7 @@ log = logging.getLogger(__file__)
 
 
 unassigned = colander.null
+unparsed = object()  # returned by Field.coerce when value must be parsed.
 
 
 class Field(colander.SchemaNode):
@@ -28,54 +30,198 @@ class Field(colander.SchemaNode):
         cloned.children = [node.clone() for node in self.children]
         return cloned
 
+    def coerce(self, value):
+        """ Convert a value which already has a python type suitable for the
+            field, return unparsed when it must go through colander.
+        """
+        return unparsed
+
+    def export(self, value):
+        """ Return value as Document.export writes it: BSON has no type for
+            some python values.
+        """
+        return value
+
+    def import_(self, value):
+        """ Return a value read by Document.import_ as the python type of
+            the field, the inverse of export.
+        """
+        return value
+
+    def compile(self):
+        """ Return a function which validates the values of the field.
+
+            Values accepted by coerce skip the str()/deserialize round trip,
+            preparer, missing and validator are applied as colander does.
+        """
+        coerce = self.coerce
+        deserialize = self.deserialize
+
+        def validate(value):
+
+            appstruct = coerce(value)
+
+            if appstruct is unparsed:
+                cstruct = str(value) if value != colander.null else value
+                return deserialize(cstruct)
+
+            if appstruct is colander.null:
+                return deserialize(colander.null)
+
+            if self.preparer is not None:
+                if hasattr(self.preparer, '__call__'):
+                    appstruct = self.preparer(appstruct)
+
+                else:
+                    for preparer in self.preparer:
+                        appstruct = preparer(appstruct)
+
+                if appstruct is colander.null:
+                    return deserialize(colander.null)
+
+            if self.validator is not None and \
+               not isinstance(self.validator, colander.deferred):
+                self.validator(self, appstruct)
+
+            return appstruct
+
+        return validate
+
 
 class ObjectId(Field):
 
     def __init__(self, missing=colander.null, **kwargs):
         Field.__init__(self, objectid(), missing=missing, **kwargs)
 
+    def coerce(self, value):
+        return value if type(value) is bson.objectid.ObjectId else unparsed
+
 
 class Integer(Field):
 
     def __init__(self, **kwargs):
         Field.__init__(self, colander.Integer(), **kwargs)
 
+    def coerce(self, value):
+        return value if type(value) is int else unparsed
+
 
 class String(Field):
 
     def __init__(self, encoding=None, **kwargs):
         Field.__init__(self, colander.String(encoding), **kwargs)
 
+    def coerce(self, value):
+        if type(value) is not str:
+            return unparsed
+
+        return value if value else colander.null
+
 
 class Boolean(Field):
 
     def __init__(self, **kwargs):
         Field.__init__(self, colander.Boolean(), **kwargs)
 
+    def coerce(self, value):
+        return value if type(value) is bool else unparsed
+
 
 class Float(Field):
 
     def __init__(self, **kwargs):
         Field.__init__(self, colander.Float(), **kwargs)
 
+    def coerce(self, value):
+        if type(value) is float:
+            return value
+
+        if type(value) is not int:
+            return unparsed
+
+        try:
+            return float(value)
+
+        except OverflowError:
+            # colander parses it as inf.
+            return unparsed
+
 
 class Date(Field):
 
     def __init__(self, **kwargs):
         Field.__init__(self, colander.Date(), **kwargs)
 
+    def coerce(self, value):
+        if type(value) is datetime.date:
+            return value
+
+        return value.date() if type(value) is datetime.datetime else unparsed
+
+    def export(self, value):
+        if type(value) is not datetime.date:
+            return value
+
+        return datetime.datetime.combine(value, datetime.time())
+
+    def import_(self, value):
+        return value.date() if type(value) is datetime.datetime else value
+
 
 class DateTime(Field):
 
     def __init__(self, tzinfo=colander.iso8601.Utc(), **kwargs):
         Field.__init__(self, colander.DateTime(tzinfo), **kwargs)
 
+    def coerce(self, value):
+
+        if type(value) is datetime.date:
+            value = datetime.datetime.combine(value, datetime.time())
+
+        elif type(value) is not datetime.datetime:
+            return unparsed
+
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=self.typ.default_tzinfo)
+
+        return value
+
+    def import_(self, value):
+        # BSON files are decoded without timezone.
+        if type(value) is not datetime.datetime or value.tzinfo is not None:
+            return value
+
+        return value.replace(tzinfo=self.typ.default_tzinfo)
+
 
 class Time(Field):
 
     def __init__(self, **kwargs):
         Field.__init__(self, colander.Time(), **kwargs)
 
+    def coerce(self, value):
+        # colander does not parse microseconds and timezones.
+        if type(value) is not datetime.time or \
+           value.microsecond or \
+           value.tzinfo is not None:
+            return unparsed
+
+        return value
+
+    def export(self, value):
+        return value.isoformat() if type(value) is datetime.time else value
+
+    def import_(self, value):
+        if type(value) is not str:
+            return value
+
+        try:
+            return datetime.time.fromisoformat(value)
+
+        except ValueError:
+            # Left to the validation.
+            return value
+
 
 class EmbeddedDocument(Field):
 
@@ -84,14 +230,15 @@ class EmbeddedDocument(Field):
         self.class_ = class_
 
         try:
-            schema = getattr(class_, class_._SCHEMA)
+            # The nodes of the fields: the schema of class_ is not built.
+            attrs = class_.__attrs__
 
         except AttributeError:
             raise ValueError('%s is not a document.' % class_)
 
         Field.__init__(self,
-                       schema.typ,
-                       *schema.children,
+                       colander.Mapping(unknown='raise'),
+                       *attrs.values(),
                        **kwargs)
 
     def clone(self):
@@ -100,6 +247,12 @@ class EmbeddedDocument(Field):
         cloned.children = [node.clone() for node in self.children]
         return cloned
 
+    def export(self, value):
+        return self.class_._export_values(value)
+
+    def import_(self, value):
+        return self.class_._import_values(value)
+
 
 class EmbeddedList(Field):
 
@@ -116,4 +269,92 @@ class EmbeddedList(Field):
         cloned.children = [node.clone() for node in self.children]
         return cloned
 
-# FIXME: add class Reference and list of Reference ?
+    def export(self, value):
+        return [self.class_._export_values(item) for item in value]
+
+    def import_(self, value):
+        if not isinstance(value, list):
+            return value
+
+        return [self.class_._import_values(item) for item in value]
+
+
+class Reference(Field):
+    """ Reference to a document of class_, stored as its _id: values are
+        documents of class_ (which must have an _id) or their _ids.
+    """
+
+    def __init__(self, class_, **kwargs):
+
+        self.class_ = class_
+
+        try:
+            id_ = class_.__attrs__['_id']
+
+        except (AttributeError, KeyError):
+            raise ValueError('%s is not a document.' % class_)
+
+        if getattr(class_, class_._COLLECTION, None) is None:
+            raise ValueError('%s has no collection.' % class_)
+
+        self.coerce_id = id_.coerce
+        Field.__init__(self, id_.typ, **kwargs)
+
+    def clone(self):
+        cloned = self.__class__(self.class_)
+        cloned.__dict__.update(self.__dict__)
+        cloned.children = [node.clone() for node in self.children]
+        return cloned
+
+    def coerce(self, value):
+
+        if not isinstance(value, self.class_):
+            return self.coerce_id(value)
+
+        if value._id is None:
+            msg = 'Cannot reference %s: it has no _id.'
+            raise colander.Invalid(self, msg % value.__class__.__name__)
+
+        return value._id
+
+
+class ReferenceList(Field):
+    """ List of references to documents of class_, stored as their _ids.
+    """
+
+    def __init__(self, class_, **kwargs):
+        self.class_ = class_
+        Field.__init__(self,
+                       colander.Sequence(False),
+                       Reference(class_),
+                       **kwargs)
+
+    def clone(self):
+        cloned = self.__class__(self.class_)
+        cloned.__dict__.update(self.__dict__)
+        cloned.children = [node.clone() for node in self.children]
+        return cloned
+
+    def compile(self):
+        """ Return a function which validates lists of references: missing
+            lists are replaced by the missing value, a callable is called.
+        """
+        deserialize = self.deserialize
+        reference = self.children[0].compile()
+
+        def validate(value):
+
+            if value is colander.null:
+                value = deserialize(value)
+                if value is colander.null:
+                    return value
+
+                if callable(value):
+                    value = value()
+
+            if not isinstance(value, (list, tuple)):
+                raise colander.Invalid(self, '%s is not a list' % (value,))
+
+            return [reference(item) for item in value]
+
+        return validate
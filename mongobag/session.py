@@ -0,0 +1,131 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import bson
+import collections
+import logging
+import weakref
+
+__all__ = ['Session']
+
+log = logging.getLogger(__file__)
+
+
+sessions = weakref.WeakSet()  # every Session, removed documents are evicted.
+
+
+class Session(object):
+    """ Identity map of the documents loaded by find and find_one when
+        they receive session=: the same _id gives the same instance and
+        find_one by _id is served without querying the database.
+
+        At most maxsize documents are kept, the least recently used ones
+        are dropped first. hits and misses count the lookups by _id.
+
+        Documents removed through Document methods are evicted from every
+        Session.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._documents = collections.OrderedDict()
+        sessions.add(self)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, obj):
+        return self._documents.get(get_key(obj.__class__, obj._id)) is obj
+
+    def get(self, class_, id_):
+        """ Return the document of class_ with _id id_, None if it is not in
+            the session.
+        """
+
+        key = get_key(class_, id_)
+        obj = self._documents.get(key)
+        if obj is None or not isinstance(obj, class_):
+            self.misses += 1
+            return None
+
+        self._documents.move_to_end(key)
+        self.hits += 1
+        return obj
+
+    def add(self, obj):
+        """ Add obj to the session and return the instance which must be
+            used: the one already in the session if it has the same _id.
+            Partial documents are returned, not added.
+        """
+
+        try:
+            id_ = obj._id
+
+        except AttributeError:
+            return obj
+
+        if id_ is None:
+            return obj
+
+        key = get_key(obj.__class__, id_)
+        current = self._documents.get(key)
+        if current is not None and isinstance(current, obj.__class__):
+            self._documents.move_to_end(key)
+            return current
+
+        if obj.is_partial():
+            return obj
+
+        self._documents[key] = obj
+        self._documents.move_to_end(key)
+        while len(self._documents) > self.maxsize:
+            self._documents.popitem(last=False)
+
+        return obj
+
+    def remove(self, obj):
+        """ Remove obj from the session, if it is there.
+        """
+
+        key = get_key(obj.__class__, obj._id)
+        if self._documents.get(key) is obj:
+            del self._documents[key]
+
+    def clear(self):
+        self._documents.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def evict_document(obj):
+    """ Remove the documents with the _id of obj from every Session: the
+        stored document was removed.
+    """
+
+    key = get_key(obj.__class__, obj._id)
+    for session in list(sessions):
+        session._documents.pop(key, None)
+
+
+def get_key(class_, id_):
+    return (getattr(class_, class_._COLLECTION), id_)
+
+
+def get_criterion_id(criterion):
+    """ Return the _id looked up by criterion, None if criterion is not a
+        plain lookup by _id.
+    """
+
+    if isinstance(criterion, bson.objectid.ObjectId):
+        return criterion
+
+    if isinstance(criterion, dict) and list(criterion) == ['_id'] and \
+       isinstance(criterion['_id'], bson.objectid.ObjectId):
+        return criterion['_id']
+
+    return None
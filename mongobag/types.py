@@ -4,9 +4,11 @@
 # This module is part of MongoBag and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
+from bson import json_util
 import bson
 import colander
 import datetime
+import json
 import logging
 
 __all__ = []
@@ -41,3 +43,26 @@ class ObjectId(object):
 
         else:
             return value
+
+
+# Extended JSON used by exports: datetimes and ObjectIds keep their type.
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=True)
+
+
+def encode_json(value):
+    """ Return the extended JSON representation of values json cannot
+        encode: Document.export converts the others (e.g. dates) first.
+    """
+    return json_util.default(value, JSON_OPTIONS)
+
+
+def dumps_json(values):
+    """ Return values, a serialized document, as a line of extended JSON.
+    """
+    return json.dumps(values, default=encode_json, separators=(',', ':'))
+
+
+def loads_json(text):
+    """ Return the serialized document encoded in text by dumps_json.
+    """
+    return json_util.loads(text, json_options=JSON_OPTIONS)
@@ -23,6 +23,9 @@ setup(name='MongoBag',
           'colander >= 0.9.9',
           'mongoq'
       ],
+      extras_require={
+          'numpy': ['numpy'],
+      },
       entry_points="""
       # -*- Entry points: -*-
       """,
@@ -0,0 +1,495 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+""" Benchmarks of mongobag, run from the package root with:
+
+    python -m tests.benchmarks [--output results.json]
+    python -m tests.benchmarks --compare results.json [--threshold 1.25]
+
+Results are the best time of one call, in seconds, by benchmark name, and
+the bytes allocated by each document of the memory benchmarks.
+In compare mode the exit status is 1 when a benchmark is slower, or uses
+more memory, than the baseline by more than threshold times.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import sys
+import timeit
+import tracemalloc
+import warnings
+
+
+log = logging.getLogger(__name__)
+
+
+BENCHMARKS = []
+MEMORY_BENCHMARKS = []
+
+
+def benchmark(name):
+    """ Register a benchmark: the decorated function receives the scale,
+        prepares the data and returns the function which is timed.
+    """
+
+    def decorator(function):
+        BENCHMARKS.append((name, function))
+        return function
+
+    return decorator
+
+
+def memory_benchmark(name):
+    """ Register a memory benchmark: the decorated function receives the
+        scale and returns the function which builds one document.
+    """
+
+    def decorator(function):
+        MEMORY_BENCHMARKS.append((name, function))
+        return function
+
+    return decorator
+
+
+def main_document_values():
+    return dict(string='A string',
+                integer=1,
+                boolean=True,
+                float=2.0,
+                datetime=datetime.datetime(2012, 8, 20, 10, 30),
+                date=datetime.date(2012, 8, 20),
+                time=datetime.time(10, 30))
+
+
+def create_page(scale=10):
+    from .models import Content, Head, Language, Meta, MetaAttr, Page
+    english = Language(name='English', code='en', country='GB')
+    head = Head(meta=[Meta(attrs=[MetaAttr(key='name', value='description')],
+                           value='Page {}'.format(i))
+                      for i in range(scale)])
+    return Page(url='/', enabled=True, head=head, language=english,
+                contents=[Content(body='Body {}'.format(i))
+                          for i in range(scale)],
+                title='Home', template='home.pt', homepage=True)
+
+
+def create_menu_values(depth, fanout=2):
+    """ Return the values of a Menu whose items are nested depth times.
+    """
+
+    def items(level):
+        if level == 0:
+            return []
+
+        return [{'label': 'Item {}'.format(i),
+                 'url': '/{}/{}'.format(level, i),
+                 'children': items(level - 1)}
+                for i in range(fanout)]
+
+    language = {'name': 'English', 'code': 'en', 'country': 'GB'}
+    return {'name': 'main',
+            'translations': [{'language': language, 'items': items(depth)}]}
+
+
+def create_accounts(count):
+    from .models import Account, Group
+    return [Account(name='Name {}'.format(i),
+                    surname='Surname',
+                    username='user{}'.format(i),
+                    password='secret',
+                    groups=[Group(name='users'), Group(name='staff')])
+            for i in range(count)]
+
+
+@benchmark('init.main_document')
+def init_main_document(scale):
+    from .models import MainDocument
+    values = main_document_values()
+    return lambda: MainDocument(**values)
+
+
+@benchmark('validate.fields')
+def validate_fields(scale):
+    from .models import MainDocument
+    values = main_document_values()
+    doc = MainDocument(**values)
+
+    def run():
+        for name in values:
+            doc.validate_field(name, values[name])
+
+    return run
+
+
+@benchmark('validate.fields.colander')
+def validate_fields_colander(scale):
+    from .models import MainDocument
+    values = main_document_values()
+    schema = MainDocument.__schema__
+
+    def run():
+        for name in values:
+            schema[name].deserialize(str(values[name]))
+
+    return run
+
+
+@benchmark('init.page')
+def init_page(scale):
+    return create_page
+
+
+@benchmark('serialize.main_document')
+def serialize_main_document(scale):
+    from .models import MainDocument
+    return MainDocument(**main_document_values()).serialize
+
+
+@benchmark('serialize.page')
+def serialize_page(scale):
+    return create_page().serialize
+
+
+@benchmark('serialize.page.changed')
+def serialize_page_changed(scale):
+    page = create_page()
+
+    def run():
+        page.title = 'Home'
+        page.contents[0].body = 'Body'
+        return page.serialize()
+
+    return run
+
+
+@benchmark('deserialize.main_document')
+def deserialize_main_document(scale):
+    from .models import MainDocument
+    values = main_document_values()
+    return lambda: MainDocument.deserialize(**values)
+
+
+@benchmark('deserialize.page')
+def deserialize_page(scale):
+    from .models import Url
+    values = create_page().serialize()
+    return lambda: Url.deserialize(**values)
+
+
+@benchmark('deserialize.redirect')
+def deserialize_redirect(scale):
+    from .models import Redirect, Url
+    values = Redirect(url='/old', enabled=True,
+                      code=301, location='/new').serialize()
+    return lambda: Url.deserialize(**values)
+
+
+@benchmark('load.page')
+def load_page(scale):
+    from .models import Url
+    values = create_page().serialize()
+    return lambda: Url.load(values)
+
+
+def deserialize_menu(depth):
+
+    def prepare(scale):
+        from .models import Menu
+        values = create_menu_values(depth)
+        return lambda: Menu.deserialize(**values)
+
+    return prepare
+
+
+for depth in (1, 3, 5):
+    name = 'deserialize.menu.depth{}'.format(depth)
+    benchmark(name)(deserialize_menu(depth))
+
+
+@benchmark('meta.class_creation')
+def meta_class_creation(scale):
+    from mongobag import Document, DocumentMeta, Integer, String
+    from .models import MainDocument, SimpleDocument
+    # Copies of the models bases: created classes must not become
+    # subclasses of the models used by the other benchmarks and tests.
+    bases = []
+    for base in (SimpleDocument, MainDocument):
+        attrs = {name: field.clone() for name, field in base.__attrs__.items()}
+        attrs.update(__module__=__name__, __collection__=base.__collection__)
+        bases.append(DocumentMeta(base.__name__, (Document,), attrs))
+
+    def run():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', SyntaxWarning)
+            DocumentMeta('MixinDocument', tuple(bases),
+                         {'__module__': __name__,
+                          'label': String(),
+                          'count': Integer()})
+
+    return run
+
+
+@benchmark('find.accounts')
+def find_accounts(scale):
+    from .fake import FakeDatabase
+    from .models import Account
+    db = FakeDatabase()
+    Account.insert_many(db, create_accounts(scale))
+    return lambda: list(Account.find(db, {}))
+
+
+@benchmark('find.accounts.trusted')
+def find_accounts_trusted(scale):
+    from .fake import FakeDatabase
+    from .models import Account
+    db = FakeDatabase()
+    Account.insert_many(db, create_accounts(scale))
+    return lambda: list(Account.find(db, {}, trusted=True))
+
+
+@benchmark('query.count')
+def query_count(scale):
+    from .fake import FakeDatabase
+    from .models import Account
+    db = FakeDatabase()
+    Account.insert_many(db, create_accounts(scale))
+    return Account.query(db).filter(Account.surname == 'Surname').count
+
+
+def create_members(db, count):
+    from .models import Account, Group, Member
+    groups = [Group(name='group{}'.format(i)) for i in range(10)]
+    Group.insert_many(db, groups)
+    accounts = create_accounts(count)
+    Account.insert_many(db, accounts)
+    Member.insert_many(db, [Member(account=account,
+                                   groups=groups[i % 10:i % 10 + 2])
+                            for i, account in enumerate(accounts)])
+
+
+def find_members(prefetch):
+
+    def prepare(scale):
+        from .fake import FakeDatabase
+        from .models import Member
+        db = FakeDatabase()
+        create_members(db, scale)
+
+        def run():
+            for member in Member.find(db, {}, prefetch=prefetch):
+                member.account
+                member.groups
+
+        return run
+
+    return prepare
+
+
+benchmark('find.members.lazy')(find_members(False))
+benchmark('find.members.prefetch')(find_members(True))
+
+
+def find_contents(windows):
+
+    def prepare(scale):
+        from .fake import FakeDatabase
+        from .models import Page
+        db = FakeDatabase()
+        create_page(scale).save(db)
+
+        def run():
+            page = Page.find_one(db, {}, windows=windows)
+            return [content.body for content in page.contents]
+
+        return run
+
+    return prepare
+
+
+benchmark('find.page.contents')(find_contents(None))
+benchmark('find.page.contents.window')(find_contents({'contents': -10}))
+
+
+def create_compact_class(base):
+    """ Return a compact copy of base, a document class of the models.
+    """
+    from mongobag import Document, DocumentMeta
+    attrs = {name: field.clone() for name, field in base.__attrs__.items()}
+    attrs.update(__module__=__name__, __collection__=base.__collection__,
+                 __compact__=True)
+    return DocumentMeta('Compact' + base.__name__, (Document,), attrs)
+
+
+def init_main_document_memory(compact):
+
+    def prepare(scale):
+        from .models import MainDocument
+        class_ = create_compact_class(MainDocument) if compact else MainDocument
+        values = main_document_values()
+        return lambda: class_(**values)
+
+    return prepare
+
+
+def load_main_document_memory(compact):
+
+    def prepare(scale):
+        from .models import MainDocument
+        class_ = create_compact_class(MainDocument) if compact else MainDocument
+        values = class_(**main_document_values()).serialize()
+        return lambda: class_.load(values)
+
+    return prepare
+
+
+memory_benchmark('memory.init.main_document')(
+    init_main_document_memory(False))
+memory_benchmark('memory.init.main_document.compact')(
+    init_main_document_memory(True))
+memory_benchmark('memory.load.main_document')(
+    load_main_document_memory(False))
+memory_benchmark('memory.load.main_document.compact')(
+    load_main_document_memory(True))
+
+
+@benchmark('bulk.insert_many')
+def bulk_insert_many(scale):
+    from .fake import FakeDatabase
+    from .models import Account
+    accounts = create_accounts(scale)
+
+    def run():
+        for account in accounts:
+            account._id = None
+
+        Account.insert_many(FakeDatabase(), accounts)
+
+    return run
+
+
+def run(names=None, scale=1000, number=None, repeat=5):
+    """ Return the best time of one call of the benchmarks by name, all of
+        them when names is None. number is the calls of each repetition,
+        computed to last about 0.2 seconds when it is None.
+    """
+
+    results = {}
+    for name, prepare in BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+
+        function = prepare(scale)
+        timer = timeit.Timer(function)
+        calls = number or timer.autorange()[0]
+        best = min(timer.repeat(number=calls, repeat=repeat))
+        results[name] = best / calls
+        log.info('%s: %.3g s', name, results[name])
+
+    return results
+
+
+def measure(names=None, scale=1000):
+    """ Return the bytes allocated by each of scale documents built by the
+        memory benchmarks, by name: all of them when names is None.
+    """
+
+    results = {}
+    for name, prepare in MEMORY_BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+
+        function = prepare(scale)
+        function()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            docs = [function() for i in range(scale)]
+            after = tracemalloc.get_traced_memory()[0]
+
+        finally:
+            tracemalloc.stop()
+
+        # The list holding the documents is not part of them.
+        results[name] = (after - before - sys.getsizeof(docs)) / scale
+        log.info('%s: %.0f B', name, results[name])
+
+    return results
+
+
+def compare(results, baseline, threshold=1.25):
+    """ Return (name, baseline, current, ratio) for the benchmarks which
+        are in both results, and the names of those slower than threshold.
+    """
+
+    rows = []
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        ratio = results[name] / baseline[name]
+        rows.append((name, baseline[name], results[name], ratio))
+        if ratio > threshold:
+            regressions.append(name)
+
+    return rows, regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='mongobag benchmarks')
+    parser.add_argument('-o', '--output', help='write results to this file')
+    parser.add_argument('-c', '--compare', help='baseline results file')
+    parser.add_argument('-t', '--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    parser.add_argument('-s', '--scale', type=int, default=1000,
+                        help='documents used by find and bulk benchmarks')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    args = parser.parse_args(argv)
+
+    results = run(args.names or None, args.scale, repeat=args.repeat)
+    memory = measure(args.names or None, args.scale)
+    report = {'python': platform.python_version(),
+              'scale': args.scale,
+              'results': results,
+              'memory': memory}
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+
+    else:
+        print(output)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as file:
+        baseline = json.load(file)
+
+    rows, regressions = compare(results, baseline['results'], args.threshold)
+    memory_rows, memory_regressions = compare(memory,
+                                              baseline.get('memory', {}),
+                                              args.threshold)
+    rows += memory_rows
+    regressions += memory_regressions
+    for name, before, after, ratio in rows:
+        flag = '  REGRESSION' if name in regressions else ''
+        print('{:<32} {:>10.3g} {:>10.3g} {:>7.2f}x{}'.format(name, before,
+                                                           after, ratio,
+                                                           flag),
+              file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
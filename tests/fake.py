@@ -0,0 +1,549 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+""" In-process stand-in for the few pymongo objects used by mongobag.
+"""
+
+import bson
+import copy
+import pymongo
+import re
+
+
+__all__ = ['FakeDatabase', 'FakeCollection',
+           'AsyncFakeDatabase', 'AsyncFakeCollection']
+
+
+def get_path(doc, path):
+    """ Return the values found in doc following a dotted path.
+    """
+    values = [doc]
+    for key in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict) and key in value:
+                found.append(value[key])
+
+            elif isinstance(value, list):
+                if key.isdigit() and int(key) < len(value):
+                    found.append(value[int(key)])
+
+                else:
+                    found.extend(item[key] for item in value
+                                 if isinstance(item, dict) and key in item)
+
+        values = found
+
+    return values
+
+
+def compare(value, other):
+    try:
+        return (value > other) - (value < other)
+
+    except TypeError:
+        return None
+
+
+def match_value(values, condition):
+
+    candidates = []
+    for value in values:
+        candidates.append(value)
+        if isinstance(value, list):
+            candidates.extend(value)
+
+    if not isinstance(condition, dict) or \
+       not any(key.startswith('$') for key in condition):
+        return any(value == condition for value in candidates)
+
+    for operator, operand in condition.items():
+
+        if operator == '$exists':
+            result = bool(values) == bool(operand)
+
+        elif operator == '$ne':
+            result = not match_value(values, operand)
+
+        elif operator == '$in':
+            result = any(value in operand for value in candidates) or \
+                     (not values and None in operand)
+
+        elif operator == '$nin':
+            result = not any(value in operand for value in candidates)
+
+        elif operator in ('$gt', '$gte', '$lt', '$lte'):
+            accepted = {'$gt': (1,), '$gte': (0, 1),
+                        '$lt': (-1,), '$lte': (-1, 0)}[operator]
+            result = any(compare(value, operand) in accepted
+                         for value in candidates)
+
+        elif operator == '$regex':
+            result = any(isinstance(value, str) and re.search(operand, value)
+                         for value in candidates)
+
+        elif operator == '$not':
+            result = not match_value(values, operand)
+
+        elif operator == '$size':
+            result = any(isinstance(value, list) and len(value) == operand
+                         for value in values)
+
+        else:
+            raise NotImplementedError(operator)
+
+        if not result:
+            return False
+
+    return True
+
+
+def match(doc, criterion):
+
+    for key, condition in (criterion or {}).items():
+
+        if key == '$and':
+            result = all(match(doc, sub) for sub in condition)
+
+        elif key == '$or':
+            result = any(match(doc, sub) for sub in condition)
+
+        elif key == '$nor':
+            result = not any(match(doc, sub) for sub in condition)
+
+        else:
+            result = match_value(get_path(doc, key), condition)
+
+        if not result:
+            return False
+
+    return True
+
+
+def project(doc, projection):
+
+    if not projection:
+        return doc
+
+    if isinstance(projection, (list, tuple)):
+        projection = {name: 1 for name in projection}
+
+    include = {name for name, value in projection.items()
+               if not isinstance(value, dict) and value and name != '_id'}
+    exclude = {name for name, value in projection.items()
+               if not isinstance(value, dict) and not value}
+
+    if include:
+        result = {name: doc[name] for name in include if name in doc}
+        if '_id' not in exclude and '_id' in doc:
+            result['_id'] = doc['_id']
+
+    else:
+        result = {name: doc[name] for name in doc if name not in exclude}
+
+    for name, value in projection.items():
+        if isinstance(value, dict) and '$slice' in value and name in doc:
+            slice_ = value['$slice']
+            if isinstance(slice_, list):
+                skip, limit = slice_
+                start = skip if skip >= 0 else max(len(doc[name]) + skip, 0)
+                result[name] = doc[name][start:start + limit]
+
+            elif slice_ >= 0:
+                result[name] = doc[name][:slice_]
+
+            else:
+                result[name] = doc[name][slice_:]
+
+    return result
+
+
+class FakeCursor(object):
+
+    def __init__(self, collection, criterion, projection=None,
+                 sort=None, skip=0, limit=0, batch_size=0):
+        self.collection = collection
+        self.criterion = criterion
+        self.projection = projection
+        self._sort = list(sort or [])
+        self._skip = skip
+        self._limit = limit
+        self._batch_size = batch_size
+        self._iterator = None
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            self._sort.extend(key)
+
+        else:
+            self._sort.append((key, direction))
+
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        return self
+
+    def explain(self):
+        indexed = any(key in self.collection.indexed_keys()
+                      for key in self.criterion or {})
+        stage = 'IXSCAN' if indexed else 'COLLSCAN'
+        return {'queryPlanner': {'winningPlan': {'stage': 'FETCH',
+                                                 'inputStage': {'stage': stage}}}}
+
+    def documents(self):
+        docs = [doc for doc in self.collection.docs
+                if match(doc, self.criterion)]
+
+        for key, direction in reversed(self._sort):
+            docs.sort(key=lambda doc: SortKey(get_path(doc, key)),
+                      reverse=direction < 0)
+
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+
+        return [self.collection.decode(project(copy.deepcopy(doc),
+                                               self.projection))
+                for doc in docs]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self.collection.calls.append(('find', self.criterion))
+            self._iterator = iter(self.documents())
+
+        return next(self._iterator)
+
+
+class SortKey(object):
+    """ Order missing values first as MongoDB does. """
+
+    def __init__(self, values):
+        self.value = values[0] if values else None
+
+    def __lt__(self, other):
+        if self.value is None:
+            return other.value is not None
+
+        if other.value is None:
+            return False
+
+        return self.value < other.value
+
+
+def set_path(doc, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        doc = doc[int(key)] if isinstance(doc, list) else doc.setdefault(key, {})
+
+    if isinstance(doc, list):
+        doc[int(keys[-1])] = value
+
+    else:
+        doc[keys[-1]] = value
+
+
+def unset_path(doc, path):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        doc = doc[int(key)] if isinstance(doc, list) else doc.get(key, {})
+
+    if isinstance(doc, dict):
+        doc.pop(keys[-1], None)
+
+
+def apply_update(doc, update):
+
+    if not any(key.startswith('$') for key in update):
+        # Replacement document.
+        id_ = doc['_id']
+        doc.clear()
+        doc.update(copy.deepcopy(update))
+        doc['_id'] = id_
+        return
+
+    for operator, values in update.items():
+        for path, value in values.items():
+            if operator == '$set':
+                set_path(doc, path, copy.deepcopy(value))
+
+            elif operator == '$unset':
+                unset_path(doc, path)
+
+            elif operator == '$inc':
+                current = get_path(doc, path)
+                set_path(doc, path, (current[0] if current else 0) + value)
+
+            elif operator == '$push':
+                current = get_path(doc, path)
+                items = current[0] if current else []
+                if isinstance(value, dict) and '$each' in value:
+                    items = items + copy.deepcopy(value['$each'])
+
+                else:
+                    items = items + [copy.deepcopy(value)]
+
+                set_path(doc, path, items)
+
+            else:
+                raise NotImplementedError(operator)
+
+
+class InsertOneResult(object):
+
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult(object):
+
+    def __init__(self, matched_count, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+        self.upserted_id = upserted_id
+
+
+class DeleteResult(object):
+
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class BulkWriteResult(object):
+
+    def __init__(self, inserted_count):
+        self.inserted_count = inserted_count
+
+
+class FakeCollection(object):
+
+    def __init__(self, database, name, document_class=dict):
+        self.database = database
+        self.name = name
+        self.full_name = '{}.{}'.format(database.name, name)
+        self.document_class = document_class
+
+    @property
+    def docs(self):
+        return self.database.data.setdefault(self.name, [])
+
+    @property
+    def calls(self):
+        return self.database.calls
+
+    def decode(self, doc):
+        return doc
+
+    def indexed_keys(self):
+        """ Return the first keys of the indexes: queries on them use one.
+        """
+        indexes = self.database.indexes.get(self.name, {})
+        return {'_id'} | {keys[0][0] for keys, options in indexes.values()}
+
+    def create_index(self, keys, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, pymongo.ASCENDING)]
+
+        name = kwargs.get('name') or '_'.join('{}_{}'.format(key, direction)
+                                              for key, direction in keys)
+        self.calls.append(('create_index', keys, kwargs))
+        indexes = self.database.indexes.setdefault(self.name, {})
+        indexes[name] = (list(keys), kwargs)
+        return name
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return FakeCursor(self, filter, projection, **kwargs)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+
+        for doc in self.find(filter, projection, limit=1, **kwargs):
+            return doc
+
+        return None
+
+    def count_documents(self, filter, skip=0, limit=0):
+        self.calls.append(('count_documents', filter))
+        docs = [doc for doc in self.docs if match(doc, filter)][skip:]
+        return len(docs[:limit] if limit else docs)
+
+    def distinct(self, key, filter=None):
+        self.calls.append(('distinct', key, filter))
+        values = []
+        for doc in self.docs:
+            if not match(doc, filter):
+                continue
+
+            for value in get_path(doc, key):
+                for item in value if isinstance(value, list) else [value]:
+                    if item not in values:
+                        values.append(item)
+
+        return values
+
+    def _insert(self, document):
+        if '_id' not in document:
+            document['_id'] = bson.objectid.ObjectId()
+
+        if any(doc['_id'] == document['_id'] for doc in self.docs):
+            msg = 'E11000 duplicate key error: _id {}'
+            raise pymongo.errors.DuplicateKeyError(msg.format(document['_id']),
+                                                   11000)
+
+        self.docs.append(copy.deepcopy(document))
+        return document['_id']
+
+    def _update(self, filter, update, upsert=False, many=False):
+        matched = 0
+        for doc in self.docs:
+            if match(doc, filter):
+                apply_update(doc, update)
+                matched += 1
+                if not many:
+                    break
+
+        if matched or not upsert:
+            return UpdateResult(matched)
+
+        doc = {key: value for key, value in filter.items()
+               if not key.startswith('$')}
+        doc.setdefault('_id', bson.objectid.ObjectId())
+        apply_update(doc, update)
+        self.docs.append(doc)
+        return UpdateResult(0, doc['_id'])
+
+    def _delete(self, filter, many=False):
+        deleted = [doc for doc in self.docs if match(doc, filter)]
+        if not many:
+            deleted = deleted[:1]
+
+        for doc in deleted:
+            self.docs.remove(doc)
+
+        return DeleteResult(len(deleted))
+
+    def insert_one(self, document):
+        self.calls.append(('insert_one', document))
+        return InsertOneResult(self._insert(document))
+
+    def replace_one(self, filter, replacement, upsert=False):
+        self.calls.append(('replace_one', filter, replacement))
+        return self._update(filter, replacement, upsert)
+
+    def update_one(self, filter, update, upsert=False):
+        self.calls.append(('update_one', filter, update))
+        return self._update(filter, update, upsert)
+
+    def delete_one(self, filter):
+        self.calls.append(('delete_one', filter))
+        return self._delete(filter)
+
+    def delete_many(self, filter):
+        self.calls.append(('delete_many', filter))
+        return self._delete(filter, many=True)
+
+    def bulk_write(self, requests, ordered=True):
+        self.calls.append(('bulk_write', requests))
+        errors = []
+        inserted = 0
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, pymongo.InsertOne):
+                    self._insert(request._doc)
+                    inserted += 1
+
+                elif isinstance(request, pymongo.DeleteOne):
+                    self._delete(request._filter)
+
+                else:
+                    self._update(request._filter, request._doc, request._upsert)
+
+            except pymongo.errors.DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                if ordered:
+                    break
+
+        if errors:
+            raise pymongo.errors.BulkWriteError({'writeErrors': errors,
+                                                 'nInserted': inserted})
+
+        return BulkWriteResult(inserted)
+
+
+class FakeDatabase(object):
+
+    def __init__(self, name='test'):
+        self.name = name
+        self.data = {}
+        self.indexes = {}
+        self.calls = []
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+
+class AsyncFakeCursor(object):
+    """ Cursor of AsyncFakeCollection, iterated with async for. """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        method = getattr(self.cursor, name)
+
+        def chain(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+
+        return chain
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.cursor)
+
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncFakeCollection(object):
+    """ Expose the FakeCollection methods as coroutines, like motor. """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.full_name = collection.full_name
+
+    def find(self, *args, **kwargs):
+        return AsyncFakeCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def coroutine(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return coroutine
+
+
+class AsyncFakeDatabase(FakeDatabase):
+
+    def __getitem__(self, name):
+        return AsyncFakeCollection(FakeCollection(self, name))
@@ -6,6 +6,8 @@ from mongobag import EmbeddedDocument
 from mongobag import EmbeddedList
 from mongobag import Float
 from mongobag import Integer
+from mongobag import Reference
+from mongobag import ReferenceList
 from mongobag import String
 from mongobag import Time
 import colander
@@ -65,6 +67,15 @@ class Account(Document):
     groups = EmbeddedList(Group, missing=list, default=list)
 
 
+class Member(Document):
+
+    __collection__ = 'members'
+
+    account = Reference(Account)
+    groups = ReferenceList(Group, missing=list, default=list)
+    sponsor = Reference(Account, missing=None, default=None)
+
+
 class MenuItem(Document):
     label = String()
     url = String()
@@ -135,6 +146,7 @@ class Sitemap(Document):
 class Url(Document):
 
     __collection__ = 'urls'
+    __discriminator__ = '_type'
 
     url = String()  # validator=Path
     enabled = Boolean(default=False)
@@ -0,0 +1,59 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run(self):
+        from .benchmarks import BENCHMARKS, run
+        results = run(scale=5, number=1, repeat=1)
+        self.assertEqual(sorted(results),
+                         sorted(name for name, prepare in BENCHMARKS))
+        self.assertTrue(all(value > 0 for value in results.values()))
+
+    def test_measure(self):
+        from .benchmarks import MEMORY_BENCHMARKS, measure
+        results = measure(scale=10)
+        self.assertEqual(sorted(results),
+                         sorted(name for name, prepare in MEMORY_BENCHMARKS))
+        # Compact documents take less memory than the default ones.
+        for name in ('memory.init.main_document', 'memory.load.main_document'):
+            self.assertLess(results[name + '.compact'], results[name])
+
+    def test_compare(self):
+        from .benchmarks import compare
+        rows, regressions = compare({'a': 2.0, 'b': 1.0, 'c': 1.0},
+                                    {'a': 1.0, 'b': 1.0})
+        self.assertEqual(rows, [('a', 1.0, 2.0, 2.0), ('b', 1.0, 1.0, 1.0)])
+        self.assertEqual(regressions, ['a'])
+
+    def test_main(self):
+        from .benchmarks import main
+        import json
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            self.assertEqual(main(['-o', path, '-s', '5', '-r', '1',
+                                   'init.main_document']), 0)
+            with open(path) as file:
+                report = json.load(file)
+
+            self.assertEqual(list(report['results']), ['init.main_document'])
+            # A baseline ten times faster makes a regression.
+            report['results']['init.main_document'] /= 10
+            with open(path, 'w') as file:
+                json.dump(report, file)
+
+            self.assertEqual(main(['-o', os.path.join(directory, 'new.json'),
+                                   '-c', path, '-s', '5', '-r', '1',
+                                   'init.main_document']), 1)
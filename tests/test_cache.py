@@ -0,0 +1,120 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        from .fake import FakeDatabase
+        from .models import Redirect
+        from mongobag import QueryCache
+        self.now = 0
+        self.db = FakeDatabase()
+        self.cache = QueryCache(maxsize=2, ttl=10, timer=lambda: self.now)
+        self.redirect = Redirect(url='/old', enabled=True,
+                                 code=301, location='/new')
+        self.redirect.save(self.db)
+
+    def test_find_one(self):
+        from .models import Redirect, Url
+        url = Url.find_one(self.db, Url.url == '/old', cache=self.cache)
+        self.assertIsInstance(url, Redirect)
+        calls = len(self.db.calls)
+        url = Url.find_one(self.db, Url.url == '/old', cache=self.cache)
+        self.assertIsInstance(url, Redirect)
+        self.assertEqual(url.location, '/new')
+        self.assertEqual(len(self.db.calls), calls)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # Cached documents are copies.
+        url.location = '/changed'
+        self.assertEqual(Url.find_one(self.db, {'url': '/old'},
+                                      cache=self.cache).location, '/new')
+
+    def test_find(self):
+        from .models import Url
+        calls = len(self.db.calls)
+        self.assertEqual(len(list(Url.find(self.db, {}, cache=self.cache))), 1)
+        self.assertEqual(len(list(Url.find(self.db, {}, cache=self.cache))), 1)
+        self.assertEqual(len(self.db.calls), calls + 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_invalidate(self):
+        from .models import Url
+        url = Url.find_one(self.db, {'url': '/old'}, cache=self.cache)
+        url.location = '/newer'
+        url.save(self.db)
+        # Writes drop the queries of their collection.
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(Url.find_one(self.db, {'url': '/old'},
+                                      cache=self.cache).location, '/newer')
+
+    def test_ttl(self):
+        from .models import Url
+        Url.find_one(self.db, {'url': '/old'}, cache=self.cache)
+        self.now = 11
+        calls = len(self.db.calls)
+        Url.find_one(self.db, {'url': '/old'}, cache=self.cache)
+        self.assertEqual(len(self.db.calls), calls + 1)
+
+    def test_maxsize(self):
+        from .models import Url
+        from mongobag import NoResultFound
+        Url(url='/a', enabled=True).insert(self.db)
+        Url.find_one(self.db, {'url': '/old'}, cache=self.cache)
+        Url.find_one(self.db, {'url': '/a'}, cache=self.cache)
+        self.assertRaises(NoResultFound, Url.find_one, self.db, {'url': '/b'},
+                          {'url': 1}, cache=self.cache)
+        self.assertEqual(len(self.cache), 2)
+        # The least recently used query was dropped.
+        calls = len(self.db.calls)
+        Url.find_one(self.db, {'url': '/old'}, cache=self.cache)
+        self.assertEqual(len(self.db.calls), calls + 1)
+
+    def test_subdocument_order(self):
+        from mongobag.cache import freeze
+        # MongoDB matches subdocuments with the order of their keys.
+        self.assertNotEqual(freeze({'a': {'x': 1, 'y': 2}}),
+                            freeze({'a': {'y': 2, 'x': 1}}))
+        self.assertEqual(freeze({'a': [{'x': 1}], 'b': {1, 2}}),
+                         freeze({'a': [{'x': 1}], 'b': {2, 1}}))
+
+    def test_max_documents(self):
+        from .fake import AsyncFakeDatabase
+        from .models import Url
+        from mongobag import QueryCache
+        import asyncio
+        for i in range(3):
+            Url(url='/{}'.format(i), enabled=True).insert(self.db)
+
+        cache = QueryCache(max_documents=3)
+        # Larger results are returned whole but not cached.
+        self.assertEqual(len(list(Url.find(self.db, {}, cache=cache))), 4)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(list(Url.find(self.db, {'enabled': True},
+                                           cache=cache))), 4)
+        self.assertEqual(len(list(Url.find(self.db, {'url': {'$ne': '/old'}},
+                                           cache=cache))), 3)
+        self.assertEqual(len(cache), 1)
+        db = AsyncFakeDatabase()
+        db.data = self.db.data
+
+        async def run():
+            cache = QueryCache(max_documents=3)
+            docs = [doc async for doc in Url.afind(db, {}, cache=cache)]
+            self.assertEqual(len(docs), 4)
+            self.assertEqual(len(cache), 0)
+            docs = [doc async for doc in Url.afind(db, {'url': '/1'},
+                                                    cache=cache)]
+            self.assertEqual([doc.url for doc in docs], ['/1'])
+            self.assertEqual(len(cache), 1)
+
+        asyncio.run(run())
@@ -0,0 +1,82 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        from .fake import FakeDatabase
+        from .models import MainDocument
+        from mongobag.columns import numpy
+        import datetime
+        if numpy is None:
+            self.skipTest('numpy is not installed')
+
+        self.db = FakeDatabase()
+        for i in range(5):
+            MainDocument(string='String {}'.format(i),
+                         integer=i,
+                         boolean=bool(i % 2),
+                         float=i / 2,
+                         datetime=datetime.datetime(2012, 8, 20, i)).save(self.db)
+
+        self.db.data['maindocument'][1].pop('float')
+        self.db.data['maindocument'][2].pop('integer')
+
+    def test_find_columns(self):
+        from .models import MainDocument
+        columns = MainDocument.find_columns(self.db, {},
+                                            [MainDocument.integer,
+                                             'float',
+                                             'boolean',
+                                             'datetime',
+                                             'string'])
+        self.assertEqual(list(columns),
+                         ['integer', 'float', 'boolean', 'datetime', 'string'])
+        self.assertEqual(columns['string'][4], 'String 4')
+
+    def test_dtypes(self):
+        from .models import MainDocument
+        from mongobag.columns import numpy
+        columns = MainDocument.find_columns(self.db, {}, ['integer', 'float',
+                                                          'boolean',
+                                                          'datetime'])
+        self.assertEqual(columns['integer'].dtype, numpy.int64)
+        self.assertEqual(columns['boolean'].dtype, numpy.bool_)
+        self.assertEqual(columns['datetime'].dtype, numpy.dtype('M8[ms]'))
+
+    def test_missing_values(self):
+        from .models import MainDocument
+        from mongobag.columns import numpy
+        columns = MainDocument.find_columns(self.db, {}, ['integer', 'float'])
+        # Missing integers are masked, missing floats are NaN.
+        self.assertEqual(list(columns['integer'].mask),
+                         [False, False, True, False, False])
+        self.assertEqual(columns['integer'].sum(), 8)
+        self.assertTrue(numpy.isnan(columns['float'][1]))
+        self.assertEqual(numpy.nansum(columns['float']), 4.5)
+        self.assertEqual(len(MainDocument.find_columns(self.db, {'integer': 9},
+                                                       ['float'])['float']), 0)
+
+    def test_iter_columns(self):
+        from .models import MainDocument
+        chunks = list(MainDocument.iter_columns(self.db,
+                                                {'integer': {'$gte': 1}},
+                                                ['integer'], chunk_size=2))
+        self.assertEqual([list(chunk['integer']) for chunk in chunks],
+                         [[1, 3], [4]])
+
+    def test_embedded(self):
+        from .models import Account
+        from mongobag import DocumentAttributeError
+        self.assertRaises(DocumentAttributeError,
+                          Account.find_columns, self.db, {}, [Account.groups])
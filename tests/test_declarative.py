@@ -86,6 +86,732 @@ class TestDeclarative(unittest.TestCase):
                       ed=dict(name='My Simple Document', surname='Surname'), edl=[])
         self.assertRaises(DocumentTypeError,  MainDocument.deserialize, **params)
 
+    def test_deserialize_discriminator(self):
+        from .models import Page, Redirect, Url
+        from mongobag import DocumentTypeError
+        self.assertEqual(Url.__registry__,
+                         {'Url': Url, 'Page': Page, 'Redirect': Redirect})
+        redirect = Redirect(url='/old', enabled=True, code=301, location='/new')
+        values = redirect.serialize()
+        self.assertEqual(values['_type'], 'Redirect')
+        doc = Url.deserialize(**values)
+        self.assertTrue(isinstance(doc, Redirect))
+        self.assertEqual(doc.location, '/new')
+        self.assertRaises(DocumentTypeError, Page.deserialize, **redirect.serialize())
+        values = redirect.serialize()
+        values['_type'] = 'Unknown'
+        self.assertRaises(DocumentTypeError, Url.deserialize, **values)
+        # Untagged documents are still resolved trying every class.
+        values = redirect.serialize()
+        del values['_type']
+        self.assertTrue(isinstance(Url.deserialize(**values), Redirect))
+        values = Url(url='/', enabled=True).serialize()
+        self.assertTrue(type(Url.deserialize(**values)) is Url)
+
+    def test_find_trusted(self):
+        from .fake import FakeDatabase
+        from .models import Head, Language, Page, Redirect, Url
+        from mongobag import DocumentTypeError, NoResultFound
+        import bson
+        db = FakeDatabase()
+        english = Language(name='English', code='en', country='GB')
+        page = Page(url='/', enabled=True, head=Head(meta=[]), language=english,
+                    contents=[], title='Home', template='home.pt',
+                    homepage=True)
+        redirect = Redirect(url='/old', enabled=True, code=301, location='/')
+        for doc in (page, redirect):
+            values = doc.serialize()
+            values['_id'] = bson.objectid.ObjectId()
+            db['urls'].insert_one(values)
+
+        docs = list(Url.find(db, {}, trusted=True))
+        self.assertEqual([type(doc) for doc in docs], [Page, Redirect])
+        self.assertEqual(docs[0].language.code, 'en')
+        self.assertEqual(docs[1].code, 301)
+        self.assertEqual(docs[1].validate(), docs[1])
+        doc = Url.find_one(db, Url.url == '/old', trusted=True)
+        self.assertEqual(doc.location, '/')
+        self.assertRaises(NoResultFound, Url.find_one, db, Url.url == '/new')
+        # Values are not validated until validate() is called.
+        db['urls'].docs[1]['code'] = 200
+        doc = Redirect.find_one(db, Url.url == '/old', trusted=True)
+        self.assertEqual(doc.code, 200)
+        self.assertRaises(DocumentTypeError, doc.validate)
+        self.assertRaises(DocumentTypeError,
+                          Redirect.find_one, db, Url.url == '/old')
+
+    def test_load_untagged(self):
+        from .fake import FakeDatabase
+        from .models import Page, Redirect, Url
+        from mongobag import DocumentTypeError
+        db = FakeDatabase()
+        redirect = Redirect(url='/old', enabled=True, code=301, location='/')
+        redirect.save(db)
+        del db.data['urls'][0]['_type']
+        # Untagged documents of subclasses are not loaded as their base.
+        doc = Url.find_one(db, {'url': '/old'}, trusted=True)
+        self.assertIsInstance(doc, Redirect)
+        self.assertEqual(doc.location, '/')
+        Url.save_many(db, [doc])
+        self.assertEqual(db.data['urls'][0], redirect.serialize())
+        del db.data['urls'][0]['_type']
+        doc = Url.find_one(db, {'url': '/old'}, fields=[Url.url, Redirect.code])
+        self.assertIsInstance(doc, Redirect)
+        self.assertEqual(doc.code, 301)
+        self.assertIs(type(Url.find_one(db, {'url': '/old'}, fields=['url'])),
+                      Url)
+        db.data['urls'][0]['unknown'] = 1
+        self.assertRaises(DocumentTypeError, Url.find_one, db,
+                          {'url': '/old'}, trusted=True)
+        self.assertRaises(DocumentTypeError, Page.find_one, db,
+                          {'url': '/old'}, trusted=True)
+
+    def test_load_lazy(self):
+        from .models import Menu, MenuItem, MenuTranslation
+        from mongobag.declarative import DocumentList
+        item = dict(label='Home', url='/', children=[
+                        dict(label='News', url='/news', children=[])])
+        translation = dict(language=dict(name='English',
+                                         code='en',
+                                         country='GB'),
+                           items=[item])
+        values = dict(name='main', translations=[translation])
+        menu = Menu.load(values)
+        self.assertEqual(menu.name, 'main')
+        # Unloaded values are passed through to the writes.
+        self.assertTrue(menu._serialize()['translations'] is
+                        values['translations'])
+        self.assertEqual(menu.serialize()['translations'],
+                         values['translations'])
+        self.assertIsNot(menu.serialize()['translations'],
+                         values['translations'])
+        translations = menu.translations
+        self.assertTrue(isinstance(translations, DocumentList))
+        self.assertTrue(isinstance(translations[0], MenuTranslation))
+        self.assertTrue(menu.translations is translations)
+        self.assertTrue(translations[0]._serialize()['items'][0] is item)
+        self.assertTrue(isinstance(translations[0].items[0], MenuItem))
+        self.assertEqual(translations[0].items[0].children[0].label, 'News')
+        self.assertEqual(translations[0].language.code, 'en')
+        self.assertEqual(menu.serialize()['translations'][0]['items'][0]['url'],
+                         '/')
+        self.assertEqual(dict(Menu.name == 'main'), {'name': 'main'})
+
+    def test_compact(self):
+        from mongobag import (Document,
+                              DocumentAttributeError,
+                              String,
+                              ValidationError,
+                              deferred_validation)
+        import colander
+        import copy
+
+        class CompactDocument(Document):
+            __compact__ = True
+            name = String()
+
+        class CompactMixin(Document):
+            __abstract__ = True
+            __compact__ = True
+            code = String(missing=colander.null, default=colander.null)
+
+        class CompactChild(CompactDocument, CompactMixin):
+            title = String()
+
+        doc = CompactChild(name='name', title='title')
+        self.assertFalse(hasattr(doc, '__dict__'))
+        self.assertEqual(doc.code, None)
+        self.assertEqual(CompactChild.__layout__[-1].name, 'title')
+        self.assertRaises(DocumentAttributeError, setattr, doc, 'other', 1)
+        CompactDocument.description = String(missing=colander.null,
+                                             default=colander.null)
+        self.assertEqual(getattr(doc, 'description', None), None)
+        doc.description = 'A description'
+        self.assertEqual(doc.serialize()['description'], 'A description')
+        self.assertEqual(dict(CompactChild.description == 'x'),
+                         {'description': 'x'})
+        self.assertEqual(CompactChild(name='x', title='y').description, None)
+        self.assertEqual(copy.deepcopy(doc).serialize(), doc.serialize())
+        self.assertEqual(CompactDocument.__slots__,
+                         ('_id', 'name', '_dirty', '_serialized', '_extra'))
+        self.assertEqual(CompactChild.__slots__, ('code', 'title'))
+        with deferred_validation():
+            doc.title = None
+
+        # The state rarely set goes in the _extra dict.
+        self.assertEqual(doc._extra, {'description': 'A description',
+                                      '_pending': True})
+        self.assertRaises(ValidationError, doc.validate)
+
+    def test_compact_mix(self):
+        from mongobag import Document, String
+        import warnings
+
+        class CompactName(Document):
+            __compact__ = True
+            name = String()
+
+        class CompactTitle(Document):
+            __compact__ = True
+            title = String()
+
+        class Title(Document):
+            title = String()
+
+        # Instances cannot have the slots of both classes.
+        with self.assertRaises(TypeError) as context:
+            type(CompactName)('Mixed', (CompactName, CompactTitle), {})
+
+        self.assertIn('CompactName and CompactTitle', str(context.exception))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', SyntaxWarning)
+
+            class Mixed(CompactName, Title):
+                pass
+
+        doc = Mixed(name='name', title='title')
+        self.assertEqual((doc.name, doc.title), ('name', 'title'))
+
+    def test_insert_many(self):
+        from .fake import FakeDatabase
+        from .models import Group
+        from mongobag import BulkWriteError
+        db = FakeDatabase()
+        groups = [Group(name='group {}'.format(i)) for i in range(5)]
+        self.assertEqual(Group.insert_many(db, iter(groups), batch_size=2), 5)
+        self.assertEqual([call[0] for call in db.calls], ['bulk_write'] * 3)
+        self.assertEqual([doc['_id'] for doc in db['groups'].docs],
+                         [group._id for group in groups])
+        groups[0].name = 'renamed'
+        new = Group(name='new')
+        self.assertEqual(Group.save_many(db, [groups[0], new]), 2)
+        self.assertEqual(db['groups'].docs[0]['name'], 'renamed')
+        self.assertEqual(len(db['groups'].docs), 6)
+        self.assertIsNotNone(new._id)
+        # Duplicated _ids are reported, unordered writes go on.
+        docs = [Group(name='a'), Group(name='b', _id=groups[1]._id), Group(name='c')]
+        try:
+            Group.insert_many(db, docs, ordered=False)
+
+        except BulkWriteError as e:
+            self.assertEqual([doc for doc, msg in e.errors], [docs[1]])
+            self.assertEqual(e.written, 2)
+
+        else:
+            self.fail('BulkWriteError not raised')
+
+        self.assertIsNotNone(docs[2]._id)
+        docs = [Group(name='d', _id=groups[1]._id), Group(name='e')]
+        self.assertRaises(BulkWriteError, Group.insert_many, db, docs)
+        self.assertIsNone(docs[1]._id)
+        self.assertEqual(len(db['groups'].docs), 8)
+
+    def test_insert_many_unprocessed(self):
+        from .fake import AsyncFakeDatabase, FakeDatabase
+        from .models import Group
+        from mongobag import BulkWriteError
+        import asyncio
+        db = FakeDatabase()
+        stored = Group(name='stored')
+        stored.insert(db)
+        for batch_size in (4, 2, 1):
+            docs = [Group(name='a'), Group(name='dup', _id=stored._id),
+                    Group(name='c'), Group(name='d')]
+            with self.assertRaises(BulkWriteError) as context:
+                Group.insert_many(db, iter(docs), batch_size=batch_size)
+
+            # The documents after the first error are not sent.
+            self.assertEqual([doc for doc, msg in context.exception.errors],
+                             [docs[1]])
+            self.assertEqual(context.exception.written, 1)
+            self.assertEqual(context.exception.unprocessed, docs[2:])
+            self.assertIsNone(docs[2]._id)
+
+        db = AsyncFakeDatabase()
+
+        async def run():
+            await stored.ainsert(db)
+            docs = [Group(name='dup', _id=stored._id), Group(name='b')]
+            with self.assertRaises(BulkWriteError) as context:
+                await Group.ainsert_many(db, docs, batch_size=1)
+
+            self.assertEqual(context.exception.unprocessed, docs[1:])
+
+        asyncio.run(run())
+
+    def test_save_removed(self):
+        from .benchmarks import create_accounts
+        from .fake import AsyncFakeDatabase, FakeDatabase
+        from .models import Account
+        from mongobag import DocumentTypeError
+        import asyncio
+        db = FakeDatabase()
+        create_accounts(1)[0].save(db)
+        account = Account.find_one(db, Account.username == 'user0')
+        account.remove(db)
+        account.name = 'Renamed'
+        # Changes are not upserted as a fragment of the document.
+        self.assertEqual(account.save(db), account._id)
+        self.assertEqual([call[0] for call in db.calls[-2:]],
+                         ['update_one', 'replace_one'])
+        self.assertEqual(db['accounts'].docs, [account.serialize()])
+        self.assertEqual(Account.find_one(db, account._id).surname, 'Surname')
+        partial = Account.find_one(db, account._id, fields=['name'])
+        partial.remove(db)
+        partial.name = 'Partial'
+        self.assertRaises(DocumentTypeError, partial.save, db)
+        self.assertEqual(db['accounts'].docs, [])
+        db = AsyncFakeDatabase()
+
+        async def run():
+            account.name = 'Async'
+            await account.asave(db)
+            self.assertEqual(db['accounts'].collection.docs,
+                             [account.serialize()])
+
+        asyncio.run(run())
+
+    def test_changes_shared(self):
+        from .benchmarks import create_accounts
+        from .models import Account
+        import copy
+        first, second = [Account.load(account.serialize())
+                         for account in create_accounts(2)]
+        first.name = 'First'
+        # Changes of a document are not seen by the other ones.
+        self.assertEqual(first.get_changes(), {'$set': {'name': 'First'}})
+        self.assertEqual(second.get_changes(), {})
+        second = copy.deepcopy(second)
+        second.surname = 'Second'
+        self.assertEqual(second.get_changes(), {'$set': {'surname': 'Second'}})
+        self.assertEqual(first.get_changes(), {'$set': {'name': 'First'}})
+
+    def test_update_changes(self):
+        from .fake import FakeDatabase
+        from .models import Content, Head, Language, MainDocument, Page
+        import datetime
+        db = FakeDatabase()
+        english = Language(name='English', code='en', country='GB')
+        page = Page(url='/', enabled=True, head=Head(meta=[]), language=english,
+                    contents=[Content(body='First')], title='Home',
+                    template='home.pt', homepage=True)
+        self.assertEqual(page.save(db), page._id)
+        self.assertEqual(db.calls[-1][0], 'insert_one')
+        self.assertEqual(page.get_changes(), {})
+        self.assertEqual(page.update(db), None)
+        page.title = 'Welcome'
+        page.contents.append(Content(body='Second'))
+        page.language.code = 'EN'
+        self.assertEqual(page.get_changes(),
+                         {'$set': {'title': 'Welcome', 'language.code': 'EN'},
+                          '$push': {'contents': {'$each': [{'_id': None,
+                                                            'body': 'Second'}]}}})
+        page.save(db)
+        self.assertEqual(db.calls[-1][:2], ('update_one', {'_id': page._id}))
+        self.assertEqual(page.get_changes(), {})
+        stored = Page.find_one(db, Page.url == '/')
+        self.assertEqual(stored.serialize(), page.serialize())
+        stored.contents[0].body = 'Changed'
+        self.assertEqual(stored.get_changes(),
+                         {'$set': {'contents.0.body': 'Changed'}})
+        stored.contents.append(Content(body='Third'))
+        self.assertEqual(list(stored.get_changes()['$set']), ['contents'])
+        stored.update(db)
+        loaded = Page.find_one(db, Page.url == '/', trusted=True)
+        self.assertEqual([content.body for content in loaded.contents],
+                         ['Changed', 'Second', 'Third'])
+        loaded.contents.pop()
+        loaded.validate()
+        self.assertEqual(list(loaded.get_changes()), ['$set'])
+        loaded.remove(db)
+        self.assertEqual(db['urls'].docs, [])
+        doc = MainDocument(string='A string', integer=1, boolean=True,
+                           float=2.0, datetime=datetime.datetime(2012, 8, 20))
+        doc.insert(db)
+        doc.datetime = None
+        self.assertEqual(doc.get_changes(), {'$unset': {'datetime': ''}})
+
+    def test_find_fields(self):
+        from .fake import FakeDatabase
+        from .models import Head, Language, Page, Redirect, Url
+        from mongobag import (DocumentAttributeError,
+                              DocumentTypeError,
+                              FieldNotLoaded)
+        db = FakeDatabase()
+        english = Language(name='English', code='en', country='GB')
+        Page(url='/', enabled=True, head=Head(meta=[]), language=english,
+             contents=[], title='Home', template='home.pt',
+             homepage=True).insert(db)
+        Redirect(url='/old', enabled=True, code=301, location='/').insert(db)
+        docs = list(Url.find(db, {}, fields=[Url.url, Page.title]))
+        self.assertEqual(db['urls'].calls[-1], ('find', {}))
+        self.assertEqual([type(doc) for doc in docs], [Page, Redirect])
+        page, redirect = docs
+        self.assertEqual(page.title, 'Home')
+        self.assertEqual(redirect.url, '/old')
+        self.assertTrue(page.is_partial())
+        self.assertRaises(FieldNotLoaded, getattr, page, 'template')
+        self.assertRaises(FieldNotLoaded, getattr, redirect, 'location')
+        self.assertEqual(set(page.serialize()), {'_id', '_type', 'url', 'title'})
+        self.assertRaises(DocumentTypeError, page.insert, db)
+        page.title = 'Welcome'
+        self.assertEqual(page.get_changes(), {'$set': {'title': 'Welcome'}})
+        page.save(db)
+        page.reload(db)
+        self.assertFalse(page.is_partial())
+        self.assertEqual(page.template, 'home.pt')
+        self.assertEqual(page.language.code, 'en')
+        self.assertEqual(Page.find_one(db, Url.url == '/').title, 'Welcome')
+        redirect = Redirect.find_one(db, Url.url == '/old',
+                                     fields=['code'], trusted=True)
+        self.assertEqual(redirect.code, 301)
+        self.assertRaises(DocumentAttributeError,
+                          list, Url.find(db, {}, fields=['unknown']))
+
+    def test_find_executor(self):
+        from .benchmarks import create_accounts
+        from .fake import FakeDatabase
+        from .models import Account
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        db = FakeDatabase()
+        accounts = create_accounts(25)
+        Account.insert_many(db, accounts)
+        for executor in (ThreadPoolExecutor(2), ProcessPoolExecutor(2)):
+            with executor:
+                for trusted in (False, True):
+                    docs = list(Account.find(db, {},
+                                             trusted=trusted,
+                                             executor=executor,
+                                             batch_size=4,
+                                             max_pending=2))
+                    self.assertEqual([doc.username for doc in docs],
+                                     [doc.username for doc in accounts])
+                    self.assertEqual(docs[3].groups[0].name, 'users')
+
+                docs = Account.find(db, {}, executor=executor, batch_size=4)
+                self.assertEqual(next(docs).username, 'user0')
+                docs.close()
+
+    def test_async(self):
+        from .benchmarks import create_accounts
+        from .fake import AsyncFakeDatabase
+        from .models import Account, Group
+        from mongobag import NoResultFound
+        import asyncio
+        db = AsyncFakeDatabase()
+        accounts = create_accounts(5)
+
+        async def run():
+            self.assertEqual(await Account.ainsert_many(db, accounts[:3]), 3)
+            for account in accounts[3:]:
+                await account.asave(db)
+
+            docs = [doc async for doc in Account.afind(db, {},
+                                                       fields=['username'])]
+            self.assertEqual([doc.username for doc in docs],
+                             [doc.username for doc in accounts])
+            account = await Account.afind_one(db, {'username': 'user1'})
+            account.groups.append(Group(name='admins'))
+            await account.asave(db)
+            self.assertEqual(db.calls[-1][0], 'update_one')
+            account = await Account.afind_one(db, {'_id': account._id})
+            self.assertEqual(account.groups[2].name, 'admins')
+            await account.aremove(db)
+            with self.assertRaises(NoResultFound):
+                await Account.afind_one(db, {'username': 'user1'})
+
+        asyncio.run(run())
+
+    def test_references(self):
+        from .benchmarks import create_accounts
+        from .fake import FakeDatabase
+        from .models import Account, Group, Member
+        from mongobag import (DocumentTypeError, FieldNotLoaded,
+                              NoResultFound, Session)
+        import bson
+        db = FakeDatabase()
+        groups = [Group(name='users'), Group(name='staff')]
+        Group.insert_many(db, groups)
+        accounts = create_accounts(4)
+        Account.insert_many(db, accounts)
+        self.assertRaises(DocumentTypeError, Member, account=Account(
+            name='a', surname='b', username='c', password='d'))
+        members = [Member(account=account, groups=groups)
+                   for account in accounts]
+        members[0].sponsor = accounts[1]._id
+        self.assertIs(members[0].account, accounts[0])
+        self.assertEqual(members[0].groups, tuple(groups))
+        self.assertRaises(FieldNotLoaded, getattr, members[0], 'sponsor')
+        self.assertEqual(members[0].serialize()['groups'],
+                         [group._id for group in groups])
+        Member.insert_many(db, members)
+        # References are loaded on access, one query each.
+        calls = len(db.calls)
+        member = Member.find_one(db, {'_id': members[0]._id})
+        self.assertEqual(member.account.username, 'user0')
+        self.assertEqual([group.name for group in member.groups],
+                         ['users', 'staff'])
+        self.assertEqual(member.sponsor.username, 'user1')
+        self.assertEqual(len(db.calls), calls + 4)
+        # find loads them with one query by class and batch.
+        calls = len(db.calls)
+        found = list(Member.find(db, {}, batch_size=3))
+        self.assertEqual(len(db.calls), calls + 5)
+        self.assertEqual([obj.account.username for obj in found],
+                         ['user{}'.format(i) for i in range(4)])
+        self.assertIs(found[0].groups[0], found[2].groups[0])
+        self.assertIsNone(found[1].sponsor)
+        self.assertEqual(len(db.calls), calls + 5)
+        # Unless prefetch is False: they are loaded on access.
+        calls = len(db.calls)
+        found = list(Member.find(db, {}, prefetch=False))
+        self.assertEqual(len(db.calls), calls + 1)
+        self.assertEqual(found[3].account.username, 'user3')
+        self.assertEqual(len(db.calls), calls + 2)
+        # Documents in the session are not loaded again.
+        session = Session()
+        calls = len(db.calls)
+        list(Member.find(db, {}, prefetch=[Member.groups], session=session))
+        list(Member.find(db, {}, prefetch=[Member.groups], session=session))
+        self.assertEqual(len(db.calls), calls + 3)
+        # Missing documents raise NoResultFound on access.
+        member.account = bson.objectid.ObjectId()
+        self.assertRaises(NoResultFound, getattr, member, 'account')
+        self.assertEqual(member.validate().get_changes(),
+                         {'$set': {'account': member.serialize()['account']}})
+
+    def test_deferred_validation(self):
+        from .fake import FakeDatabase
+        from .models import MainDocument, SimpleDocument
+        from mongobag import (Document, DocumentAttributeError,
+                              DocumentTypeError, Integer, String,
+                              ValidationError, deferred_validation)
+
+        class Range(Document):
+            __collection__ = 'ranges'
+            __deferred__ = True
+            name = String()
+            low = Integer()
+            high = Integer()
+
+            def validate_document(self):
+                if self.low > self.high:
+                    raise DocumentAttributeError('low is greater than high')
+
+        db = FakeDatabase()
+        obj = Range()
+        obj.low = 'five'
+        obj.high = '1'
+        self.assertEqual(obj.low, 'five')
+        with self.assertRaises(ValidationError) as context:
+            obj.insert(db)
+
+        self.assertEqual(sorted(context.exception.errors), ['low', 'name'])
+        self.assertEqual(db.calls, [])
+        obj.low = 5
+        obj.name = 'range'
+        with self.assertRaises(ValidationError) as context:
+            obj.validate()
+
+        self.assertEqual(context.exception.errors,
+                         {None: 'low is greater than high'})
+        obj.high = '10'
+        obj.save(db)
+        self.assertEqual(obj.high, 10)
+        self.assertEqual(db.data['ranges'][0]['high'], 10)
+        obj.high = '20'
+        obj.save(db)
+        self.assertEqual(db.calls[-1][2], {'$set': {'high': 20}})
+        # Other classes defer validation in a context.
+        self.assertRaises(DocumentTypeError, MainDocument, integer='one')
+        with deferred_validation():
+            doc = MainDocument(integer='one', ed=SimpleDocument(name=''),
+                               edl=[SimpleDocument(name='a'),
+                                    SimpleDocument()])
+            doc.string = 'A string'
+
+        self.assertEqual(doc.integer, 'one')
+        with self.assertRaises(ValidationError) as context:
+            doc.validate()
+
+        self.assertEqual(sorted(context.exception.errors),
+                         ['boolean', 'ed.name', 'edl.1.name', 'float',
+                          'integer'])
+        self.assertRaises(ValidationError, MainDocument.insert_many, db, [doc])
+        doc.integer, doc.boolean, doc.float = 1, True, 1
+        doc.ed.name = doc.edl[1].name = 'b'
+        MainDocument.insert_many(db, [doc])
+        self.assertEqual(doc.float, 1.0)
+
+    def test_deferred_switch(self):
+        from mongobag import Document, DocumentAttributeError, String
+        from mongobag import declarative
+        from unittest import mock
+
+        class Note(Document):
+            __collection__ = 'notes'
+            title = String()
+
+        with mock.patch.object(declarative, 'deferred', False):
+            # Until validation is deferred nothing is pending.
+            note = Note(title='title')
+            self.assertFalse(note._is_pending())
+            self.assertRaises(DocumentAttributeError, setattr, note,
+                              'title', None)
+            Note.__deferred__ = True
+            self.assertTrue(declarative.deferred)
+            note.title = None
+            self.assertTrue(note._is_pending())
+
+    def test_windows(self):
+        from .fake import FakeDatabase
+        from .models import MainDocument, SimpleDocument
+        from mongobag import DocumentAttributeError, DocumentTypeError
+        db = FakeDatabase()
+        doc = MainDocument(string='A string', integer=1, boolean=True,
+                           float=1.0, edl=[SimpleDocument(name=str(i))
+                                           for i in range(10)])
+        doc.save(db)
+
+        def names():
+            return [item['name'] for item in db.data['maindocument'][0]['edl']]
+
+        # The latest items: they can be appended but not changed.
+        obj = MainDocument.find_one(db, {'_id': doc._id}, windows={'edl': -3})
+        self.assertEqual([item.name for item in obj.edl], ['7', '8', '9'])
+        self.assertTrue(obj.is_partial())
+        obj.edl.append(SimpleDocument(name='10'))
+        self.assertEqual(list(obj.get_changes()), ['$push'])
+        obj.save(db)
+        self.assertEqual(names()[-2:], ['9', '10'])
+        self.assertRaises(DocumentTypeError, obj.edl.insert, 0,
+                          SimpleDocument(name='a'))
+        self.assertRaises(DocumentTypeError, obj.edl.pop)
+        self.assertRaises(DocumentTypeError, MainDocument.save_many, db, [obj])
+        obj.edl[0].name = 'x'
+        self.assertRaises(DocumentTypeError, obj.get_changes)
+        self.assertRaises(DocumentTypeError, obj.load_window, db, 'edl', 2)
+        # Windows which start at a known position can be changed.
+        obj, = MainDocument.find(db, {}, fields=[MainDocument.string],
+                                 windows=[(MainDocument.edl, (2, 3))])
+        self.assertEqual([item.name for item in obj.edl], ['2', '3', '4'])
+        obj.edl[1].name = 'y'
+        self.assertEqual(obj.get_changes(), {'$set': {'edl.3.name': 'y'}})
+        obj.update(db)
+        self.assertEqual(names()[2:5], ['2', 'y', '4'])
+        self.assertEqual([item.name for item in obj.load_window(db, 'edl', 2)],
+                         ['0', '1'])
+        self.assertEqual([item.name for item in obj.edl], ['0', '1'])
+        # Items are pushed without loading the list.
+        calls = len(db.calls)
+        obj = MainDocument.find_one(db, doc._id, fields=['string'])
+        obj.push(db, MainDocument.edl, SimpleDocument(name='11'))
+        self.assertEqual(db.calls[-1][0], 'update_one')
+        self.assertEqual(len(db.calls), calls + 2)
+        self.assertEqual(names()[-2:], ['10', '11'])
+        obj = MainDocument.find_one(db, doc._id)
+        self.assertEqual(len(obj.edl), 12)
+        obj.push(db, 'edl', SimpleDocument(name='12'))
+        self.assertEqual(len(obj.edl), 13)
+        self.assertEqual(obj.get_changes(), {})
+        self.assertFalse(obj.is_partial())
+        self.assertRaises(DocumentAttributeError, MainDocument.find_one, db,
+                          doc._id, windows={'string': 1})
+        self.assertRaises(ValueError, MainDocument.find_one, db, doc._id,
+                          windows={'edl': (1, 0)})
+
+    def test_export_import(self):
+        from .benchmarks import create_accounts
+        from .fake import FakeDatabase
+        from .models import Account, MainDocument
+        from concurrent.futures import ThreadPoolExecutor
+        from mongobag.declarative import iter_records
+        import bson
+        import datetime
+        import io
+        import itertools
+        db = FakeDatabase()
+        Account.insert_many(db, create_accounts(7))
+        for format in ('jsonl', 'bson'):
+            file = io.BytesIO()
+            self.assertEqual(Account.export(db, {}, file, format,
+                                            batch_size=3), 7)
+            other = FakeDatabase()
+            with ThreadPoolExecutor(2) as executor:
+                file.seek(0)
+                self.assertEqual(Account.import_(other, file, format,
+                                                 batch_size=3,
+                                                 executor=executor), 7)
+
+            self.assertEqual(other.data['accounts'], db.data['accounts'])
+            file.seek(0)
+            self.assertEqual(Account.import_(other, file, format), 7)
+            self.assertEqual(len(other.data['accounts']), 7)
+
+        doc = MainDocument(string='A string', integer=1, boolean=True,
+                           float=2.0,
+                           datetime=datetime.datetime(2012, 8, 20, 10, 30),
+                           date=datetime.date(2012, 8, 20),
+                           time=datetime.time(10, 30))
+        doc.save(db)
+        for format, trusted in itertools.product(('jsonl', 'bson'),
+                                                 (False, True)):
+            file = io.BytesIO()
+            MainDocument.export(db, {}, file, format)
+            # Exported values are encoded by BSON as well.
+            file.seek(0)
+            for record in iter_records(file, format):
+                self.assertIsInstance(bson.encode(record), bytes)
+
+            file.seek(0)
+            other = FakeDatabase()
+            MainDocument.import_(other, file, format, trusted=trusted)
+            loaded = MainDocument.find_one(other, {'_id': doc._id},
+                                           trusted=True)
+            for name in ('string', 'datetime', 'date', 'time'):
+                self.assertEqual(getattr(loaded, name), getattr(doc, name))
+
+        self.assertRaises(ValueError, Account.export, db, {}, file, 'csv')
+
+    def test_instrumentation(self):
+        from .fake import FakeDatabase
+        from .models import Account, Group, Redirect, Url
+        from mongobag import Metrics, set_instrumentation
+        db = FakeDatabase()
+        metrics = Metrics()
+        self.assertIsNone(set_instrumentation(metrics))
+        try:
+            account = Account(name='Name', surname='Surname',
+                              username='user', password='secret',
+                              groups=[Group(name='users')])
+            account.save(db)
+            list(Account.find(db, {}))
+            Account.find_one(db, {'username': 'user'})
+            Url.deserialize(url='/old', enabled=True, code=301,
+                            location='/new')
+
+        finally:
+            self.assertIs(set_instrumentation(None), metrics)
+
+        counts = metrics.counts
+        # Five fields for each of the three documents, then the new _id.
+        self.assertEqual(counts['validate', 'Account', 'validate_field'], 16)
+        self.assertEqual(counts['validate', 'Account',
+                                'validate_embedded_list'], 3)
+        self.assertEqual(counts['call', 'Account', 'accounts.insert_one'], 1)
+        self.assertEqual(counts['call', 'Account', 'accounts.find'], 1)
+        self.assertEqual(counts['call', 'Account', 'accounts.find_one'], 1)
+        self.assertEqual(counts['deserialize', 'Account', None], 2)
+        self.assertEqual(counts['serialize', 'Account', None], 1)
+        self.assertEqual(metrics.candidates['Url'], 3)
+        self.assertTrue(all(duration >= 0
+                            for duration in metrics.durations.values()))
+        count = sum(counts.values())
+        Account.find_one(db, {'username': 'user'})
+        Redirect(url='/', enabled=True, code=301, location='/new')
+        self.assertEqual(sum(counts.values()), count)
+
     def test_serialize(self):
         from .models import MainDocument
         from .models import SimpleDocument
@@ -102,6 +828,58 @@ class TestDeclarative(unittest.TestCase):
         self.assertIn('name', values['ed'])
         self.assertIn('name', values['edl'][0])
 
+    def test_serialize_cache(self):
+        from .models import MainDocument
+        from .models import SimpleDocument
+        doc = MainDocument(string='A string',
+                           integer=1,
+                           boolean=True,
+                           float=2.0,
+                           ed=SimpleDocument(name='Embedded Document'),
+                           edl=[SimpleDocument(name='First')])
+        values = doc._serialize()
+        again = doc._serialize()
+        self.assertIs(again, values)
+        doc.ed.name = 'Changed'
+        values = doc._serialize()
+        self.assertEqual(values['ed']['name'], 'Changed')
+        self.assertIsNot(values['ed'], again['ed'])
+        self.assertIs(values['edl'], again['edl'])
+        doc.edl.append(SimpleDocument(name='Second'))
+        values = doc._serialize()
+        self.assertEqual([item['name'] for item in values['edl']],
+                         ['First', 'Second'])
+        self.assertIs(values['edl'][0], again['edl'][0])
+        doc.edl[0].name = 'Changed'
+        self.assertEqual(doc.serialize()['edl'][0]['name'], 'Changed')
+        doc.integer = 2
+        self.assertEqual(doc.serialize()['integer'], 2)
+
+    def test_serialize_copy(self):
+        from .fake import FakeDatabase
+        from .models import MainDocument, SimpleDocument
+        db = FakeDatabase()
+        doc = MainDocument(string='A string', integer=1, boolean=True,
+                           float=2.0, ed=SimpleDocument(name='orig'),
+                           edl=[SimpleDocument(name='First')])
+        # Callers own the result: changing it changes nothing saved.
+        values = doc.serialize()
+        values['string'] = 'Changed'
+        values['ed']['name'] = 'Changed'
+        values['edl'][0]['name'] = 'Changed'
+        values['edl'].append({'name': 'Second'})
+        self.assertEqual(doc.serialize(), doc._serialize())
+        self.assertEqual(doc.serialize()['ed']['name'], 'orig')
+        doc.save(db)
+        stored = db.data['maindocument'][0]
+        self.assertEqual(stored['ed']['name'], 'orig')
+        self.assertEqual([item['name'] for item in stored['edl']], ['First'])
+        doc.serialize()['ed']['name'] = 'Changed'
+        doc.integer = 2
+        doc.save(db)
+        self.assertEqual(db.calls[-1][2], {'$set': {'integer': 2}})
+        self.assertEqual(stored['ed']['name'], 'orig')
+
     def test_no_abstract_document_id_presence(self):
         from mongobag import DocumentMeta
         self.assertRaises(TypeError, DocumentMeta, 'MyDoc', (object,), {})
@@ -115,3 +893,78 @@ class TestDeclarative(unittest.TestCase):
         class_.my_attr = None
         self.assertEqual(class_.my_attr, None)
         self.assertRaises(AttributeError, setattr, class_, '_id', None)
+
+    def test_meta_registry(self):
+        from mongobag import (Document, DocumentMeta, EmbeddedDocument,
+                              Integer, String)
+        base = DocumentMeta('Base', (Document,), {'__collection__': 'base',
+                                                  'name': String()})
+        child = DocumentMeta('Child', (base,), {'age': Integer()})
+        grandchild = DocumentMeta('GrandChild', (child,), {})
+        # Embedding a class does not build its schema.
+        embedded = EmbeddedDocument(base)
+        self.assertNotIn('__schema_node__', vars(base))
+        self.assertEqual([node.name for node in embedded.children],
+                         ['_id', 'name'])
+        self.assertEqual([node.name for node in base.__schema__.children],
+                         ['_id', 'name'])
+        # Inherited fields are shared, not copied.
+        self.assertIs(grandchild.__attrs__['name'], base.__attrs__['name'])
+        self.assertIs(grandchild.__validators__['age'],
+                      child.__validators__['age'])
+        self.assertEqual(base.__all_subclasses__(), [child, grandchild])
+        self.assertEqual(child.__all_subclasses__(), [grandchild])
+        # Late fields reach the subclasses and their built schemas.
+        self.assertEqual(len(grandchild.__schema__.children), 3)
+        child.email = String()
+        self.assertNotIn('email', base.__attrs__)
+        self.assertEqual([node.name for node in grandchild.__schema__.children],
+                         ['_id', 'name', 'age', 'email'])
+        obj = grandchild(name='a', age=1, email='b')
+        self.assertEqual(obj.email, 'b')
+        # Instances give the schema of their class.
+        self.assertIs(obj.__schema__, grandchild.__schema__)
+        self.assertIs(getattr(obj, obj._SCHEMA), grandchild.__schema__)
+        del obj
+        # Collected classes leave the registry.
+        del grandchild
+        import gc
+        gc.collect()
+        self.assertEqual(base.__all_subclasses__(), [child])
+
+    def test_validate_field_compiled(self):
+        from .benchmarks import main_document_values
+        from .models import MainDocument
+        values = main_document_values()
+        doc = MainDocument(**values)
+        schema = getattr(MainDocument, MainDocument._SCHEMA)
+        # Compiled validators give the values of the str/deserialize path.
+        for name in values:
+            self.assertEqual(doc.validate_field(name, values[name]),
+                             schema[name].deserialize(str(values[name])))
+
+    def test_validate_field(self):
+        from .models import MainDocument, Redirect
+        from mongobag import DocumentAttributeError, DocumentTypeError
+        import datetime
+        doc = MainDocument(string='A string', integer=1, boolean=True, float=2)
+        self.assertEqual(doc.float, 2.0)
+        self.assertEqual(doc.datetime, None)
+        doc.datetime = datetime.datetime(2012, 8, 20, 10, 30, 0)
+        self.assertIsNotNone(doc.datetime.tzinfo)
+        doc.integer = '3'
+        self.assertEqual(doc.integer, 3)
+        doc.time = datetime.time(10, 30)
+        self.assertEqual(doc.time, datetime.time(10, 30))
+        doc.float = 10 ** 400
+        self.assertEqual(doc.float, float('inf'))
+        for name, value in [('integer', True),
+                            ('integer', 2.5),
+                            ('float', False),
+                            ('string', ''),
+                            ('time', datetime.time(10, 30, 0, 1))]:
+            self.assertRaises(DocumentAttributeError, setattr, doc, name, value)
+
+        self.assertRaises(DocumentTypeError,
+                          Redirect, url='/', enabled=True,
+                          code=200, location='/home')
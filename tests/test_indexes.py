@@ -0,0 +1,72 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestIndexes(unittest.TestCase):
+
+    def setUp(self):
+        from .fake import FakeDatabase
+        from mongobag import Document, DocumentMeta, Index, String
+        from mongobag.indexes import clear_explained
+        import mongoq
+        import pymongo
+        clear_explained()
+        indexes = [Index(mongoq.Q.slug, unique=True),
+                   [('title', pymongo.DESCENDING), 'slug']]
+        self.Article = DocumentMeta('Article', (Document,),
+                                    {'__collection__': 'articles',
+                                     '__explain__': True,
+                                     '__indexes__': indexes,
+                                     'title': String(),
+                                     'slug': String()})
+        self.db = FakeDatabase()
+        self.article = self.Article(title='Title', slug='title')
+        self.article.insert(self.db)
+
+    def test_unindexed_warning(self):
+        from mongobag import UnindexedQueryWarning
+        import warnings
+        Article = self.Article
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            Article.find_one(self.db, Article.title == 'Title')
+            # Queries with the same shape are explained once.
+            self.assertEqual(list(Article.find(self.db, Article.title == 'A')),
+                             [])
+            Article.find_one(self.db, self.article._id)
+
+        self.assertEqual([w.category for w in caught], [UnindexedQueryWarning])
+
+    def test_ensure_indexes(self):
+        from mongobag import Document
+        import warnings
+        Article = self.Article
+        self.assertEqual(Article.ensure_indexes(self.db),
+                         ['slug_1', 'title_-1_slug_1'])
+        self.assertEqual(self.db.indexes['articles']['slug_1'],
+                         ([('slug', 1)], {'unique': True}))
+        self.assertIn('slug_1', Document.ensure_indexes(self.db))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            Article.find_one(self.db, Article.title == 'Title')
+            Article.find_one(self.db, Article.slug == 'title')
+
+        self.assertEqual(caught, [])
+
+    def test_declaration(self):
+        from mongobag import Document, DocumentMeta, Index
+        self.assertRaises(TypeError, DocumentMeta, 'Invalid', (Document,),
+                          {'__indexes__': ['missing']})
+        self.Article.__indexes__ = [self.Article.slug]
+        self.assertEqual(self.Article.__indexes__, [Index('slug')])
+        self.assertRaises(ValueError, Index)
+        self.assertRaises(TypeError, setattr, self.Article, '__indexes__', [1])
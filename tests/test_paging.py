@@ -0,0 +1,69 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestPaging(unittest.TestCase):
+
+    def setUp(self):
+        from .benchmarks import create_accounts
+        from .fake import FakeDatabase
+        from .models import Account
+        self.db = FakeDatabase()
+        accounts = create_accounts(10)
+        for i, account in enumerate(accounts):
+            account.name = 'Name {}'.format(i % 4)
+
+        Account.insert_many(self.db, accounts)
+
+    def test_paginate(self):
+        from .models import Account
+        ids = [obj._id for obj in Account.find(self.db, {})]
+        pages = []
+        token = None
+        while True:
+            docs, token = Account.paginate(self.db, {}, 4, token)
+            pages.append([obj._id for obj in docs])
+            if token is None:
+                break
+
+        self.assertEqual(pages, [ids[:4], ids[4:8], ids[8:]])
+
+    def test_compound_keys(self):
+        from .models import Account
+        import pymongo
+        query = Account.query(self.db) \
+                       .filter(Account.surname == 'Surname') \
+                       .sort((Account.name, pymongo.DESCENDING)) \
+                       .only(Account.username)
+        docs, token = query.paginate(3)
+        names = [(obj.name, obj.username) for obj in docs]
+        calls = len(self.db.calls)
+        while token is not None:
+            docs, token = query.paginate(3, token)
+            names.extend((obj.name, obj.username) for obj in docs)
+
+        # One query by page, documents with the same name by _id.
+        self.assertEqual(len(self.db.calls), calls + 3)
+        self.assertEqual(names, sorted([('Name {}'.format(i % 4),
+                                         'user{}'.format(i))
+                                        for i in range(10)],
+                                       key=lambda item: item[0],
+                                       reverse=True))
+        self.assertIn('$or', self.db.calls[-1][1]['$and'][1])
+
+    def test_invalid_token(self):
+        from .models import Account
+        self.assertRaises(ValueError, Account.paginate, self.db, {}, 4, 'token')
+        docs, token = Account.paginate(self.db, {}, 4)
+        # Tokens are bound to the sort keys of their query.
+        query = Account.query(self.db).sort(Account.name)
+        self.assertRaises(ValueError, query.paginate, 3, token)
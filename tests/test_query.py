@@ -0,0 +1,96 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        from .benchmarks import create_accounts
+        from .fake import FakeDatabase
+        from .models import Account
+        self.db = FakeDatabase()
+        Account.insert_many(self.db, create_accounts(6))
+        self.query = Account.query(self.db).filter(Account.surname == 'Surname')
+
+    def test_filter(self):
+        from .models import Account
+        named = self.query.filter(Account.name == 'Name 1')
+        self.assertEqual(named.get_criterion(),
+                         {'surname': 'Surname', 'name': 'Name 1'})
+        # Conditions on the same field are combined with $and.
+        self.assertEqual(self.query.filter(Account.surname != 'Other')
+                                   .get_criterion(),
+                         {'$and': [{'surname': 'Surname'},
+                                   {'surname': {'$ne': 'Other'}}]})
+        self.assertEqual(self.query.filter(name='Name 2').get_criterion(),
+                         {'surname': 'Surname', 'name': 'Name 2'})
+
+    def test_count(self):
+        from .models import Account
+        # Counts are computed by the server: no document is loaded.
+        calls = len(self.db.calls)
+        self.assertEqual(self.query.count(), 6)
+        self.assertEqual(self.query.filter(Account.name == 'Name 1').count(), 1)
+        self.assertEqual(self.query.skip(2).limit(3).count(), 3)
+        self.assertTrue(self.query.filter(name='Name 1').exists())
+        self.assertFalse(self.query.filter(name='Nobody').exists())
+        self.assertEqual([call[0] for call in self.db.calls[calls:]],
+                         ['count_documents'] * 5)
+
+    def test_distinct(self):
+        from .models import Account
+        self.assertEqual(sorted(self.query.distinct(Account.name)),
+                         ['Name {}'.format(i) for i in range(6)])
+        self.assertEqual(sorted(self.query.distinct('groups.name')),
+                         ['staff', 'users'])
+        self.assertEqual(self.db.calls[-1][0], 'distinct')
+
+    def test_sort(self):
+        from .models import Account
+        import pymongo
+        ordered = self.query.sort((Account.username, pymongo.DESCENDING))
+        self.assertEqual([obj.username for obj in ordered.skip(1).limit(2)],
+                         ['user4', 'user3'])
+        self.assertEqual(ordered.first().username, 'user5')
+        self.assertEqual(len(list(self.query)), 6)
+
+    def test_first_one(self):
+        from mongobag import MultipleResultsFound, NoResultFound
+        self.assertIsNone(self.query.filter(name='Nobody').first())
+        self.assertEqual(self.query.filter(username='user2').one().name,
+                         'Name 2')
+        self.assertRaises(MultipleResultsFound, self.query.one)
+        self.assertRaises(NoResultFound, self.query.filter(name='Nobody').one)
+
+    def test_only(self):
+        from .models import Account
+        from mongobag import FieldNotLoaded
+        obj = self.query.only(Account.username).sort(Account.username).first()
+        self.assertEqual(obj.username, 'user0')
+        self.assertRaises(FieldNotLoaded, getattr, obj, 'surname')
+
+    def test_field_names(self):
+        from mongobag import Document, Integer, String
+        # Fields named like the query methods do not shadow them.
+
+        class Stat(Document):
+            __collection__ = 'stats'
+            name = String()
+            count = Integer()
+            distinct = Integer()
+
+        Stat(name='views', count=3, distinct=2).insert(self.db)
+        Stat(name='clicks', count=1, distinct=1).insert(self.db)
+        query = Stat.query(self.db)
+        self.assertEqual(query.count(), 2)
+        self.assertTrue(query.filter(name='views').exists())
+        self.assertEqual(sorted(query.distinct(Stat.count)), [1, 3])
@@ -0,0 +1,105 @@
+# Copyright (C) 2012 the MongoBag authors and contributors
+# <see AUTHORS file>
+#
+# This module is part of MongoBag and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import unittest
+
+
+log = logging.getLogger(__name__)
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        from .benchmarks import create_accounts
+        from .fake import FakeDatabase
+        from .models import Account
+        self.db = FakeDatabase()
+        self.accounts = create_accounts(3)
+        Account.insert_many(self.db, self.accounts)
+
+    def test_find_one(self):
+        from .models import Account
+        from mongobag import Session
+        session = Session()
+        id_ = self.accounts[0]._id
+        first = Account.find_one(self.db, {'_id': id_}, session=session)
+        calls = len(self.db.calls)
+        # Lookups by _id are served by the session.
+        self.assertIs(Account.find_one(self.db, id_, session=session), first)
+        self.assertIs(Account.find_one(self.db, {'_id': id_}, session=session),
+                      first)
+        self.assertEqual(len(self.db.calls), calls)
+        self.assertEqual((session.hits, session.misses), (2, 1))
+        self.assertIs(Account.find_one(self.db, Account.username == 'user0',
+                                       session=session),
+                      first)
+        self.assertEqual(len(self.db.calls), calls + 1)
+
+    def test_find_evicts(self):
+        from .models import Account
+        from mongobag import Session
+        session = Session(maxsize=2)
+        first = Account.find_one(self.db, self.accounts[0]._id,
+                                 session=session)
+        docs = list(Account.find(self.db, {}, session=session))
+        self.assertIs(docs[0], first)
+        # The least recently used document is dropped.
+        self.assertEqual(len(session), 2)
+        self.assertNotIn(first, session)
+        self.assertIn(docs[2], session)
+
+    def test_partial(self):
+        from .models import Account
+        from mongobag import Session
+        session = Session()
+        partial = Account.find_one(self.db, {'username': 'user0'},
+                                   fields=['username'], session=session)
+        self.assertTrue(partial.is_partial())
+        self.assertNotIn(partial, session)
+        self.assertEqual(len(session), 0)
+
+    def test_remove(self):
+        from .models import Account
+        from mongobag import Session
+        session = Session()
+        docs = list(Account.find(self.db, {}, session=session))
+        session.remove(docs[2])
+        self.assertNotIn(docs[2], session)
+        self.assertIsNot(Account.find_one(self.db, self.accounts[2]._id,
+                                          session=session),
+                         docs[2])
+        session.clear()
+        self.assertEqual((len(session), session.hits, session.misses),
+                         (0, 0, 0))
+
+    def test_remove_document(self):
+        from .fake import AsyncFakeDatabase
+        from .models import Account
+        from mongobag import NoResultFound, Session
+        import asyncio
+        sessions = [Session(), Session()]
+        docs = [Account.find_one(self.db, self.accounts[0]._id, session=session)
+                for session in sessions]
+        # Removed documents are evicted from every session.
+        self.accounts[0].remove(self.db)
+        for doc, session in zip(docs, sessions):
+            self.assertNotIn(doc, session)
+            self.assertRaises(NoResultFound, Account.find_one, self.db,
+                              self.accounts[0]._id, session=session)
+
+        db = AsyncFakeDatabase()
+        session = Session()
+
+        async def run():
+            await self.accounts[1].ainsert(db)
+            doc = await Account.afind_one(db, self.accounts[1]._id,
+                                          session=session)
+            self.assertIn(doc, session)
+            await doc.aremove(db)
+            self.assertNotIn(doc, session)
+
+        asyncio.run(run())